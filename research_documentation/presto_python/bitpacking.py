@@ -0,0 +1,130 @@
+"""
+Unpack and pack 1-, 2- and 4-bit samples stored in bytes.
+
+Unpacking uses a 256-entry lookup table per (nbits, bitorder) that
+maps each byte onto its samples, so a whole array of bytes is
+expanded with a single 'np.take' into a (possibly preallocated)
+output buffer.
+
+PSRFITS stores the first sample in the most significant bits of each
+byte (bitorder='big'), whereas SIGPROC filterbank files store it in
+the least significant bits (bitorder='little').
+"""
+
+import numpy as np
+
+# Lookup tables, created on demand. Keys are (nbits, bitorder).
+_luts = {}
+
+
+def check_nbits(nbits):
+    """Raise a ValueError if samples of 'nbits' bits
+        cannot be packed into bytes.
+    """
+    if nbits not in (1, 2, 4):
+        raise ValueError("Only 1-, 2- and 4-bit samples can be " \
+                         "(un)packed (nbits provided: %g)!" % nbits)
+
+
+def get_shifts(nbits, bitorder='big'):
+    """Return the bit shift of each sample within a byte.
+
+        Inputs:
+            nbits: Number of bits per sample.
+            bitorder: 'big' if the first sample is stored in the most
+                significant bits, 'little' otherwise. (Default: 'big')
+
+        Output:
+            shifts: Array of 8/nbits shifts, one per sample.
+    """
+    check_nbits(nbits)
+    shifts = np.arange(8//nbits, dtype=np.uint8)*nbits
+    if bitorder == 'big':
+        shifts = shifts[::-1]
+    elif bitorder != 'little':
+        raise ValueError("Unrecognized bit order (%s)!" % bitorder)
+    return shifts
+
+
+def get_lut(nbits, bitorder='big'):
+    """Return the lookup table expanding a byte into its samples.
+
+        Inputs:
+            nbits: Number of bits per sample.
+            bitorder: 'big' or 'little'. See 'get_shifts'.
+                (Default: 'big')
+
+        Output:
+            lut: A (256, 8/nbits) array of uint8. Row 'b' contains
+                the samples packed in byte 'b'.
+    """
+    key = (nbits, bitorder)
+    if key not in _luts:
+        shifts = get_shifts(nbits, bitorder)
+        mask = (1 << nbits) - 1
+        lut = (np.arange(256)[:,np.newaxis] >> shifts) & mask
+        _luts[key] = lut.astype(np.uint8)
+    return _luts[key]
+
+
+def unpack(data, nbits, bitorder='big', out=None):
+    """Unpack samples that have been read in as bytes.
+
+        Inputs:
+            data: Array of bytes (uint8). Samples are unpacked along
+                the last axis.
+            nbits: Number of bits per sample.
+            bitorder: 'big' or 'little'. See 'get_shifts'.
+                (Default: 'big')
+            out: Contiguous uint8 array with the same number of
+                elements as the unpacked data to unpack into.
+                (Default: allocate a new array)
+
+        Output:
+            outdata: Unpacked array of uint8. Its last axis is 8/nbits
+                times longer than that of 'data'.
+    """
+    lut = get_lut(nbits, bitorder)
+    data = np.asarray(data).view(np.uint8)
+    shape = data.shape[:-1] + (data.shape[-1]*lut.shape[1],)
+    if out is None:
+        out = np.empty(shape, dtype=np.uint8)
+    # mode='clip' lets 'take' write directly into 'out'. All
+    # byte values are valid indices so nothing is clipped.
+    np.take(lut, data, axis=0, out=out.reshape(data.shape+lut.shape[1:]), \
+            mode='clip')
+    return out.reshape(shape)
+
+
+def pack(data, nbits, bitorder='big', out=None):
+    """Pack samples into bytes.
+
+        Inputs:
+            data: Array of integer samples in the range [0, 2**nbits).
+                Samples are packed along the last axis, whose length
+                must be a multiple of 8/nbits.
+            nbits: Number of bits per sample.
+            bitorder: 'big' or 'little'. See 'get_shifts'.
+                (Default: 'big')
+            out: uint8 array to pack into. (Default: allocate a
+                new array)
+
+        Output:
+            outdata: Packed array of uint8. Its last axis is 8/nbits
+                times shorter than that of 'data'.
+    """
+    shifts = get_shifts(nbits, bitorder)
+    nper = len(shifts)
+    data = np.asarray(data)
+    if data.shape[-1] % nper:
+        raise ValueError("Cannot pack %d samples into %d-bit bytes. " \
+                         "Number of samples must be a multiple of %d." % \
+                         (data.shape[-1], nbits, nper))
+    samples = data.astype(np.uint8).reshape(data.shape[:-1] + \
+                                            (data.shape[-1]//nper, nper))
+    samples <<= shifts
+    shape = samples.shape[:-1]
+    if out is None:
+        out = np.empty(shape, dtype=np.uint8)
+    np.bitwise_or.reduce(samples, axis=-1, out=out.reshape(shape))
+    return out.reshape(shape)
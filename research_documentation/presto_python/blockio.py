@@ -0,0 +1,281 @@
+"""
+Block-wise reading of filterbank and PSRFITS data.
+
+A reader object (e.g. filterbank.FilterbankFile or psrfits.PsrfitsFile)
+is iterated over in blocks of spectra. The blocks are read on a
+background thread into a small pool of reusable buffers so that disk
+access overlaps with whatever processing is done on each block.
+
+Readers must provide:
+    nspec: The total number of spectra available.
+    _alloc_rows(nspec): Return an empty array that can hold 'nspec'
+        rows (i.e. spectra) as returned by '_read_rows'.
+    _read_rows(start, nspec, out=None): Read up to 'nspec' spectra
+        starting at spectrum 'start' into the rows of 'out' and
+        return the filled part of 'out'.
+    _make_spectra(rows, start, dtype): Wrap rows returned by
+        '_read_rows' in a spectra.Spectra object storing its
+        data as 'dtype'.
+
+Data too large to fit in memory can be processed block by block with
+'iter_transformed' or 'transform_blocks'. Consecutive blocks overlap
+by the maximum dispersion delay so that the stitched output is the
+same as if the whole observation had been processed at once.
+"""
+
+import copy
+import sys
+import threading
+
+import numpy as np
+
+import psr_utils
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+# Sentinel put on the queue once all blocks have been read
+_DONE = object()
+
+
+def get_block_starts(reader, block_size, start=0, nspec=None):
+    """Return the starting spectrum of each block and the
+        index of the spectrum after the last one to read.
+
+        Inputs:
+            reader: The reader object.
+            block_size: Number of new spectra per block.
+            start: First spectrum to read. (Default: 0)
+            nspec: Number of spectra to read. (Default: read to
+                the end of the data)
+
+        Outputs:
+            starts: A list of block starting spectra.
+            stop: The index of the spectrum after the last one.
+    """
+    if block_size < 1:
+        raise ValueError("Block size must be positive (%d)!" % block_size)
+    stop = int(reader.nspec)
+    if nspec is not None:
+        stop = min(stop, int(start+nspec))
+    return list(range(int(start), stop, int(block_size))), stop
+
+
+def make_block(reader, rows, start, dtype):
+    """Wrap rows read into a reusable buffer in a spectra.Spectra
+        object whose data are a copy of the rows.
+    """
+    block = reader._make_spectra(rows, start, dtype)
+    block.data # Copy the rows before the buffer is reused
+    return block
+
+
+def iter_blocks(reader, block_size, overlap=0, prefetch=2, start=0, \
+                nspec=None, dtype='float32'):
+    """Iterate over the data of 'reader' in blocks of spectra.
+
+        Inputs:
+            reader: The reader object (see module documentation).
+            block_size: Number of new spectra per block.
+            overlap: Number of spectra at the end of each block that
+                are repeated at the start of the next one (e.g. the
+                maximum dispersion delay in bins). (Default: 0)
+            prefetch: Number of blocks to read ahead on a background
+                thread. If 0, read blocks synchronously. (Default: 2)
+            start: First spectrum to read. (Default: 0)
+            nspec: Number of spectra to read. (Default: read to
+                the end of the data)
+            dtype: Data type of each block's Spectra. If None, keep
+                the native sample type. (Default: float32)
+
+        Outputs:
+            blocks: A generator of spectra.Spectra objects. Each
+                block contains up to 'block_size+overlap' spectra.
+                Each block's data are copied out of the reusable read
+                buffers before it is yielded, so blocks can be kept.
+    """
+    if overlap < 0:
+        raise ValueError("Overlap cannot be negative (%d)!" % overlap)
+    starts, stop = get_block_starts(reader, block_size, start, nspec)
+    nread = int(block_size + overlap)
+
+    if prefetch < 1:
+        buf = reader._alloc_rows(nread)
+        for blockstart in starts:
+            rows = reader._read_rows(blockstart, \
+                                     min(nread, stop-blockstart), out=buf)
+            yield make_block(reader, rows, blockstart, dtype)
+        return
+
+    # One buffer per queued block and one being filled by the
+    # background thread.
+    free = queue.Queue()
+    for ii in range(prefetch+1):
+        free.put(reader._alloc_rows(nread))
+    ready = queue.Queue(maxsize=prefetch)
+    stopping = threading.Event()
+
+    def produce():
+        for blockstart in starts:
+            buf = free.get()
+            if stopping.is_set():
+                return
+            try:
+                rows = reader._read_rows(blockstart, \
+                                         min(nread, stop-blockstart), out=buf)
+            except Exception:
+                ready.put((None, sys.exc_info()[1], buf))
+                return
+            ready.put((blockstart, rows, buf))
+        ready.put(_DONE)
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            item = ready.get()
+            if item is _DONE:
+                break
+            blockstart, rows, buf = item
+            if blockstart is None:
+                # 'rows' holds the exception raised by the reader
+                raise rows
+            block = make_block(reader, rows, blockstart, dtype)
+            free.put(buf)
+            yield block
+    finally:
+        # Unblock the background thread if the consumer stops early
+        stopping.set()
+        while thread.is_alive():
+            free.put(None)
+            try:
+                ready.get(timeout=0.01)
+            except queue.Empty:
+                pass
+        thread.join()
+
+
+def get_dispersion_overlap(freqs, dt, dm):
+    """Return the largest dispersion delay across 'freqs' in
+        samples, as used by spectra.Spectra.dedisperse.
+
+        Inputs:
+            freqs: Channel frequencies (in MHz).
+            dt: Sample time (in seconds).
+            dm: The DM (in pc/cm^3).
+
+        Output:
+            overlap: The largest delay (in samples).
+    """
+    ref_delay = psr_utils.delay_from_DM(dm, np.max(freqs))
+    delays = psr_utils.delay_from_DM(dm, np.asarray(freqs))
+    return int(np.max(np.round((delays-ref_delay)/dt)))
+
+
+def iter_transformed(reader, transform, block_size, maxdm=0, overlap=0, \
+                     lookbehind=0, prefetch=2, start=0, nspec=None, \
+                     dtype='float32'):
+    """Apply a transform to the data of 'reader' block by block.
+
+        Inputs:
+            reader: The reader object (see module documentation).
+            transform: A function that takes a spectra.Spectra object
+                and returns a (possibly new) Spectra object. It may
+                downsample the data by a factor that divides
+                'block_size' and 'lookbehind'.
+            block_size: Number of new spectra per block.
+            maxdm: Largest DM (in pc/cm^3) used by 'transform'. The
+                maximum dispersion delay at this DM is added to the
+                overlap between blocks. (Default: 0)
+            overlap: Number of following spectra each output spectrum
+                of 'transform' depends on, in addition to the
+                dispersion delay. (Default: 0)
+            lookbehind: Number of preceding spectra each output
+                spectrum of 'transform' depends on (e.g. the delay
+                across a subband when subbanding with 'subdm').
+                (Default: 0)
+            prefetch: See 'iter_blocks'. (Default: 2)
+            start: First spectrum to read. (Default: 0)
+            nspec: Number of spectra to read. (Default: read to
+                the end of the data)
+            dtype: See 'iter_blocks'. (Default: float32)
+
+        Outputs:
+            results: A generator of Spectra objects, the outputs of
+                'transform' without the parts computed from the
+                overlaps. Concatenated, they are identical to the
+                output of 'transform' applied to all of the data at
+                once, as long as each output spectrum only depends on
+                the 'lookbehind' preceding and the 'overlap' following
+                input spectra (e.g. when shifting channels with a
+                numeric 'padval').
+    """
+    overlap += get_dispersion_overlap(reader.freqs, reader.tsamp, maxdm)
+    stop = get_block_starts(reader, block_size, start, nspec)[1]
+    # Block 'ii' covers spectra blockstart to blockstart+block_size+
+    # lookbehind+overlap. The first block keeps the outputs of its first
+    # block_size+lookbehind spectra. The others drop 'lookbehind' spectra
+    # at the start, then keep 'block_size'.
+    for block in iter_blocks(reader, block_size, \
+                             overlap=overlap+lookbehind, prefetch=prefetch, \
+                             start=start, nspec=nspec, dtype=dtype):
+        blockstart = int(np.round(block.starttime/reader.tsamp))
+        if blockstart > start:
+            keepstart = blockstart+lookbehind
+        else:
+            keepstart = blockstart
+        keepstop = min(stop, blockstart+lookbehind+block_size)
+        if keepstart >= stop:
+            break
+        result = transform(block)
+        factor = int(np.round(result.dt/reader.tsamp))
+        if block_size % factor or lookbehind % factor:
+            raise ValueError("The block size (%d) and look-behind (%d) " \
+                             "must be multiples of the downsampling " \
+                             "factor (%d)!" % \
+                             (block_size, lookbehind, factor))
+        lo = (keepstart-blockstart)//factor
+        if keepstop < stop:
+            hi = (keepstop-blockstart)//factor
+        else:
+            # Keep everything up to the end of the data
+            hi = result.numspectra
+        result.data = result.data[:,lo:hi]
+        result.numspectra = hi-lo
+        result.starttime += lo*result.dt
+        yield result
+
+
+def transform_blocks(reader, transform, block_size, maxdm=0, overlap=0, \
+                     lookbehind=0, prefetch=2, start=0, nspec=None, \
+                     dtype='float32'):
+    """Apply a transform to the data of 'reader' block by block
+        and stitch the outputs together. See 'iter_transformed'.
+
+        Output:
+            result: A Spectra object identical to the output of
+                'transform' applied to all of the data at once.
+    """
+    result = None
+    for part in iter_transformed(reader, transform, block_size, maxdm=maxdm, \
+                                 overlap=overlap, lookbehind=lookbehind, \
+                                 prefetch=prefetch, start=start, \
+                                 nspec=nspec, dtype=dtype):
+        if result is None:
+            # Allocate the whole output once
+            stop = get_block_starts(reader, block_size, start, nspec)[1]
+            factor = int(np.round(part.dt/reader.tsamp))
+            nout = (stop-int(start))//factor
+            data = np.empty((part.numchans, nout), dtype=part.data.dtype)
+            result = copy.copy(part)
+            result.data = data
+            result.numspectra = nout
+            filled = 0
+        data[:,filled:filled+part.numspectra] = part.data
+        filled += part.numspectra
+    return result
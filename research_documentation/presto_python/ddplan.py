@@ -0,0 +1,176 @@
+"""
+Plan and run two-stage (subband) dedispersion over a range of DMs.
+
+As with PRESTO's DDplan.py, the DM range is split into stages in which
+the data are downsampled by successive factors of 2 as the smearing
+within channels grows. Each stage is covered by passes: channels are
+combined into subbands once at the pass's subband DM, then many nearby
+DMs are dedispersed from the subbands. This reduces the cost by about
+a factor nchan/nsub compared to dedispersing all channels at every DM.
+"""
+
+import numpy as np
+
+import psr_utils
+import spectra
+
+# DM steps (in pc/cm^3) that can be used by a plan
+ALLOWED_DMSTEPS = [0.01, 0.02, 0.03, 0.05, 0.1, 0.2, 0.3, 0.5, \
+                   1.0, 2.0, 3.0, 5.0, 10.0, 20.0, 30.0, 50.0, \
+                   100.0, 200.0, 300.0]
+
+
+class DedispPass(object):
+    """A single subbanding pass of a dedispersion plan.
+    """
+    def __init__(self, subdm, lodm, dmstep, numdms, numsub, downsamp):
+        """DedispPass constructor.
+
+            Inputs:
+                subdm: DM (in pc/cm^3) used to combine the channels
+                    within each subband.
+                lodm: Lowest DM (in pc/cm^3) of the pass.
+                dmstep: Step (in pc/cm^3) between DMs.
+                numdms: Number of DMs dedispersed.
+                numsub: Number of subbands.
+                downsamp: Downsampling factor.
+
+            Output:
+                ddpass: The DedispPass object.
+        """
+        self.subdm = subdm
+        self.lodm = lodm
+        self.dmstep = dmstep
+        self.numdms = numdms
+        self.numsub = numsub
+        self.downsamp = downsamp
+
+    def get_dms(self):
+        """Return the DMs dedispersed by this pass.
+        """
+        return self.lodm + np.arange(self.numdms)*self.dmstep
+
+    def __str__(self):
+        return "%9.3f %9.3f %9.3f %8.3f %6d %6d %5d" % \
+                (self.subdm, self.lodm, self.get_dms()[-1], self.dmstep, \
+                 self.numdms, self.numsub, self.downsamp)
+
+
+def get_dmstep(dmstep):
+    """Return the largest allowed DM step not larger than 'dmstep'.
+    """
+    allowed = [step for step in ALLOWED_DMSTEPS if step <= dmstep]
+    if allowed:
+        return allowed[-1]
+    return ALLOWED_DMSTEPS[0]
+
+
+def plan(freqs, dt, lodm, hidm, numsub, ok_smearing=0.0, maxdownsamp=64):
+    """Plan the dedispersion of DMs from 'lodm' to 'hidm'.
+
+        Inputs:
+            freqs: Channel frequencies (in MHz).
+            dt: Sample time (in seconds).
+            lodm: Lowest DM (in pc/cm^3) to search.
+            hidm: Highest DM (in pc/cm^3) to search.
+            numsub: Number of subbands. Must be a factor of the
+                number of channels.
+            ok_smearing: Total smearing (in ms) that is acceptable
+                regardless of the sample time. Larger values give
+                larger DM steps. (Default: 0)
+            maxdownsamp: Largest downsampling factor. (Default: 64)
+
+        Output:
+            passes: A list of DedispPass objects covering the DM range.
+    """
+    numchan = len(freqs)
+    assert (numchan % numsub) == 0
+    assert 0 <= lodm < hidm
+    chanwidth = np.abs(np.max(freqs)-np.min(freqs))/max(1, numchan-1)
+    BW = chanwidth*numchan
+    fctr = 0.5*(np.max(freqs)+np.min(freqs))
+    # Smearing (in seconds) within a channel at a DM of 1 pc/cm^3
+    unit_chan_smear = psr_utils.dm_smear(1.0, chanwidth, fctr)
+
+    passes = []
+    dm = lodm
+    downsamp = 1
+    while dm < hidm:
+        dt_eff = dt*downsamp
+        # Move to the next downsampling factor once the smearing
+        # within channels exceeds twice the sample time
+        if downsamp < maxdownsamp:
+            stage_hidm = min(hidm, 2*dt_eff/unit_chan_smear)
+        else:
+            stage_hidm = hidm
+        if stage_hidm <= dm:
+            downsamp *= 2
+            continue
+        # DM step that adds as much smearing as the sample time
+        tau_chan = psr_utils.dm_smear(stage_hidm, chanwidth, fctr)
+        maxsmear = max(ok_smearing/1000.0, \
+                       np.sqrt(tau_chan**2 + 2*dt_eff**2))
+        dmstep = get_dmstep(psr_utils.best_dm_step(1000.0*maxsmear*1.0001, \
+                            dt_eff, stage_hidm, fctr, numchan, chanwidth))
+        # Range of DMs for which the channels within a subband
+        # combined at a single DM are smeared by less than 'dt_eff'
+        subspan = psr_utils.guess_DMstep(dm, dt_eff, BW/numsub, fctr)
+        dms_per_pass = max(1, int(subspan/dmstep))
+        numdms = int(np.ceil((stage_hidm-dm)/dmstep))
+        # Extend the stage to a whole number of passes, since each pass
+        # costs a full subbanding of the data however few DMs it has,
+        # but do not go past 'hidm'. The DMs are then split evenly
+        # between the passes so the last one is not left tiny.
+        numdms = min(int(np.ceil(numdms/float(dms_per_pass)))*dms_per_pass, \
+                     int(np.ceil((hidm-dm)/dmstep)))
+        numpasses = int(np.ceil(numdms/float(dms_per_pass)))
+        edges = np.round(np.linspace(0, numdms, numpasses+1)).astype('int')
+        for ii, jj in zip(edges[:-1], edges[1:]):
+            npass = jj-ii
+            passlodm = dm + ii*dmstep
+            subdm = passlodm + 0.5*(npass-1)*dmstep
+            passes.append(DedispPass(subdm, passlodm, dmstep, npass, \
+                                     numsub, downsamp))
+        dm += numdms*dmstep
+        downsamp *= 2
+    return passes
+
+
+def print_plan(passes):
+    """Print a table describing the passes of a dedispersion plan.
+    """
+    print "    subDM     lowDM    highDM   dDM     #DMs   #sub  down"
+    for ddpass in passes:
+        print ddpass
+
+
+def dedisperse_plan(spec, passes, padval=0, nthreads=None):
+    """Run a dedispersion plan on a Spectra object.
+
+        Inputs:
+            spec: The Spectra object. It is not modified.
+            passes: A list of DedispPass objects (see 'plan').
+            padval: The padding value to use when shifting channels
+                within subbands. See Spectra.shift_channels.
+                (Default: 0)
+            nthreads: Number of threads passed to
+                Spectra.dedisperse_trials. (Default: use the
+                threads set with spectra.Spectra.set_executor)
+
+        Output:
+            results: A list with one (dms, trials) tuple per pass.
+                'trials' is a (numdms, nsamp/downsamp) float32 array
+                of dedispersed time series.
+    """
+    results = []
+    for ddpass in passes:
+        # Copy the data once per pass. It is converted when first used.
+        sub = spectra.Spectra(spec.freqs, spec.dt, spec.data, \
+                              starttime=spec.starttime, dtype=spec.dtype)
+        sub.dm = spec.dm
+        sub.subband(ddpass.numsub, subdm=ddpass.subdm, padval=padval)
+        if ddpass.downsamp > 1:
+            sub.downsample(ddpass.downsamp)
+        dms = ddpass.get_dms()
+        results.append((dms, sub.dedisperse_trials(dms, nthreads=nthreads)))
+    return results
@@ -0,0 +1,121 @@
+"""
+Fast Dispersion Measure Transform (FDMT).
+
+Dedisperse filterbank data at every integer delay (in samples) up to
+a maximum, following Zackay & Ofek (2017). Channels are treated as
+point frequencies. Adjacent groups of channels are merged pairwise in
+log2(nchan) iterations. At each iteration, the partial sums of a group
+at each delay across the group are built from the partial sums of its
+two halves, so the total cost is O(nsamp*(maxdelay+nchan)*log2(nchan))
+instead of O(nsamp*nchan) per trial DM.
+
+Delays follow the convention of psr_utils.delay_from_DM and
+spectra.Spectra.dedisperse: they are relative to the highest
+frequency, and time series are indexed by the arrival time at the
+highest frequency. Samples shifted in from beyond the end of the data
+are 0 (i.e. padval=0).
+
+Because delays are rounded to whole samples at every iteration, the
+delay applied to a channel can differ by a sample from the one used
+by Spectra.dedisperse. This reduces the response to pulses that are
+only one or two samples wide.
+"""
+
+import numpy as np
+
+
+def get_delay_fractions(freqs):
+    """Return the fraction of the dispersion delay across the whole
+        band accumulated between each frequency and the highest one.
+
+        Input:
+            freqs: Channel frequencies (in MHz).
+
+        Output:
+            fracs: Array of the same size as 'freqs' with values
+                from 0 (highest frequency) to 1 (lowest frequency).
+    """
+    invsq = 1.0/np.asarray(freqs, dtype='float')**2
+    span = invsq.max()-invsq.min()
+    if span == 0:
+        return np.zeros_like(invsq)
+    return (invsq-invsq.min())/span
+
+
+def fdmt(data, freqs, maxdelay):
+    """Dedisperse 'data' at every delay from 0 to 'maxdelay'.
+
+        Inputs:
+            data: A 2D array of shape (nchan, nsamp).
+            freqs: Frequency (in MHz) of each channel. Channels can
+                be in any order.
+            maxdelay: The largest dispersion delay (in samples)
+                between the lowest and highest frequencies.
+
+        Output:
+            plane: A (maxdelay+1, nsamp) float32 array. Row 'd' is
+                the sum over channels along the dispersion curve with
+                a delay of 'd' samples across the band.
+    """
+    nchan, nsamp = data.shape
+    assert len(freqs) == nchan
+    maxdelay = int(maxdelay)
+    assert maxdelay >= 0
+    fracs = get_delay_fractions(freqs)
+    # Process channels from the highest frequency to the lowest
+    order = np.argsort(fracs, kind='mergesort')
+    fracs = fracs[order]
+
+    # Each group of channels is (top frac, bottom frac, partial sums)
+    # The partial sums have one row per delay across the group.
+    groups = [(fracs[ii], fracs[ii], \
+               np.asarray(data[ichan], dtype='float32')[np.newaxis,:]) \
+              for ii, ichan in enumerate(order)]
+    while len(groups) > 1:
+        merged = [merge_groups(groups[ii], groups[ii+1], maxdelay) \
+                  for ii in range(0, len(groups)-1, 2)]
+        if len(groups) % 2:
+            merged.append(groups[-1])
+        groups = merged
+
+    plane = groups[0][2]
+    if len(plane) < maxdelay+1:
+        # There is no dispersion across the band
+        plane = np.repeat(plane, maxdelay+1, axis=0)
+    return plane
+
+
+def merge_groups(upper, lower, maxdelay):
+    """Merge two adjacent groups of channels.
+
+        Inputs:
+            upper: The group with the higher frequencies, as a tuple
+                (top frac, bottom frac, partial sums).
+            lower: The group with the lower frequencies.
+            maxdelay: The largest delay (in samples) across the
+                whole band.
+
+        Output:
+            merged: The merged group.
+    """
+    utop, ubot, usums = upper
+    ltop, lbot, lsums = lower
+    nsamp = usums.shape[1]
+    ndelay = int(np.round(maxdelay*(lbot-utop)))+1
+    sums = np.empty((ndelay, nsamp), dtype='float32')
+    span = lbot-utop
+    for delay in range(ndelay):
+        if span > 0:
+            # Split the delay across the merged group between the
+            # upper group, the gap between groups and the lower group
+            udelay = min(int(np.round(delay*(ubot-utop)/span)), \
+                         len(usums)-1)
+            gap = int(np.round(delay*(ltop-utop)/span))
+            ldelay = min(max(delay-gap, 0), len(lsums)-1)
+        else:
+            udelay = gap = ldelay = 0
+        row = sums[delay]
+        row[:] = usums[udelay]
+        if gap < nsamp:
+            row[:nsamp-gap] += lsums[ldelay,gap:]
+    return (utop, lbot, sums)
@@ -9,13 +9,31 @@ import sys
 import warnings
 import os
 import os.path
+import struct
+import threading
 import numpy as np
 import sigproc
 import spectra
+import blockio
+import bitpacking
+from psr_constants import SECPERDAY
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
 
 DEBUG = False
 
+# SIGPROC stores the first of several sub-byte samples
+# in the least significant bits of each byte
+BITORDER = 'little'
+
+# Approximate number of bytes read at once when
+# selecting channels or decimating in time
+READ_CHUNK_BYTES = 16*1024**2
+
 def create_filterbank_file(outfn, header, spectra=None, nbits=8, \
                            verbose=False, mode='append'):
     """Write filterbank header and spectra to file.
@@ -27,6 +45,7 @@ def create_filterbank_file(outfn, header, spectra=None, nbits=8, \
                 any spectra - i.e. write out header only)
             nbits: The number of bits per sample of the filterbank file.
                 This value always overrides the value in the header dictionary.
+                1-, 2- and 4-bit samples are packed into bytes.
                 (Default: 8 - i.e. each sample is an 8-bit integer)
             verbose: If True, be verbose (Default: be quiet)
             mode: Mode for writing (can be 'append' or 'write')
@@ -50,7 +69,10 @@ def create_filterbank_file(outfn, header, spectra=None, nbits=8, \
         outfile.write(sigproc.addto_hdr(paramname, value))
     outfile.write(sigproc.addto_hdr("HEADER_END", None))
     if spectra is not None:
-        spectra.flatten().astype(dtype).tofile(outfile)
+        data = spectra.flatten().astype(dtype)
+        if nbits < 8:
+            data = bitpacking.pack(data, nbits, BITORDER)
+        data.tofile(outfile)
     outfile.close()
     return FilterbankFile(outfn, mode=mode)
 
@@ -88,9 +110,9 @@ def check_nbits(nbits):
         Output:
             None
     """
-    if nbits not in [32, 16, 8]:
+    if nbits not in [32, 16, 8, 4, 2, 1]:
         raise ValueError("'filterbank.py' only supports " \
-                                    "files with 8- or 16-bit " \
+                                    "files with 1-, 2-, 4-, 8- or 16-bit " \
                                     "integers, or 32-bit floats " \
                                     "(nbits provided: %g)!" % nbits)
 
@@ -104,11 +126,14 @@ def get_dtype(nbits):
                 file's header.
 
         Output:
-            dtype: A numpy-recognized dtype string.
+            dtype: A numpy-recognized dtype string. Samples of
+                fewer than 8 bits are unpacked into 'uint8'.
     """
     check_nbits(nbits)
     if is_float(nbits):
         dtype = 'float%d' % nbits
+    elif nbits < 8:
+        dtype = 'uint8'
     else:
         dtype = 'uint%d' % nbits
     return dtype
@@ -127,35 +152,52 @@ def read_header(filename, verbose=False):
             header: A dictionary of header paramters.
             header_size: The size of the header in bytes.
     """
-    header = {}
-    filfile = open(filename, 'rb')
-    filfile.seek(0)
-    paramname = ""
-    while (paramname != 'HEADER_END'):
-        if verbose:
-            print ("File location: %d" % filfile.tell())
-        paramname, val = sigproc.read_hdr_val(filfile, stdout=verbose)
-        if verbose:
-            print ("Read param %s (value: %s)" % (paramname, val))
-        if paramname not in ["HEADER_START", "HEADER_END"]:
-            header[paramname] = val
-    header_size = filfile.tell()
-    filfile.close()
+    header, header_size = sigproc.read_header(filename)
+    for paramname in ["HEADER_START", "HEADER_END"]:
+        header.pop(paramname, None)
+    if verbose:
+        for paramname in sorted(header.keys()):
+            print ("Read param %s (value: %s)" % (paramname, header[paramname]))
     return header, header_size
 
 
 class FilterbankFile(object):
-    def __init__(self, filfn, mode='readonly'):
+    def __init__(self, filfn, mode='readonly', mmap=False):
+        """FilterbankFile constructor.
+
+            Inputs:
+                filfn: The filterbank file's name.
+                mode: Mode for opening the file. Can be 'readonly',
+                    'readwrite' or 'append'. (Default: 'readonly')
+                mmap: If True, expose the data section of the file as a
+                    read-only numpy memmap (self.data) of shape
+                    (nspec, nchans). 'get_spectra' then returns views
+                    of the memmap instead of reading from the file.
+                    For files with fewer than 8 bits per sample the
+                    memmap contains the packed bytes, of shape
+                    (nspec, bytes_per_spectrum), and spectra are
+                    unpacked when read. (Default: read spectra
+                    from the file)
+        """
         self.filename = filfn
         self.filfile = None
+        self.mmap = mmap
+        self.data = None
+        # Serialise file access between the caller and
+        # background read-ahead threads (see 'iter_blocks')
+        self._lock = threading.Lock()
         if not os.path.isfile(filfn):
             raise ValueError("ERROR: File does not exist!\n\t(%s)" % filfn)
         self.header, self.header_size = read_header(self.filename)
         self.frequencies = self.fch1 + self.foff*np.arange(self.nchans)
         self.is_hifreq_first = (self.foff < 0)
-        self.bytes_per_spectrum = self.nchans*self.nbits / 8
+        if (self.nchans*self.nbits) % 8:
+            raise ValueError("Spectra of %d %d-bit channels are not a " \
+                             "whole number of bytes!" % \
+                             (self.nchans, self.nbits))
+        self.bytes_per_spectrum = self.nchans*self.nbits // 8
         data_size = os.path.getsize(self.filename)-self.header_size
-        self.nspec = data_size/self.bytes_per_spectrum
+        self.nspec = data_size//self.bytes_per_spectrum
        
         # Check if this file is a folded-filterbank file
         if 'npuls' in self.header and 'period' in self.header and \
@@ -175,6 +217,8 @@ class FilterbankFile(object):
             tinfo = np.iinfo(self.dtype)
         self.dtype_min = tinfo.min
         self.dtype_max = tinfo.max
+        if self.nbits < 8:
+            self.dtype_max = 2**self.nbits - 1
 
         if mode.lower() in ('read', 'readonly'):
             self.filfile = open(self.filename, 'rb')
@@ -185,6 +229,26 @@ class FilterbankFile(object):
         else:
             raise ValueError("Unrecognized mode (%s)!" % mode)
 
+        if self.mmap:
+            self._map_data()
+
+    def _map_data(self):
+        """Memory-map the data section of the file.
+            This is called again whenever the number of spectra
+            in the file changes.
+        """
+        nspec = int(self.nspec)
+        if self.nbits < 8:
+            shape = (nspec, self.bytes_per_spectrum)
+        else:
+            shape = (nspec, self.nchans)
+        if nspec > 0:
+            self.data = np.memmap(self.filename, dtype=self.dtype, mode='r', \
+                                  offset=self.header_size, shape=shape)
+        else:
+            # Empty files cannot be memory-mapped
+            self.data = np.empty(shape, dtype=self.dtype)
+
     @property
     def freqs(self):
         # Alias for frequencies
@@ -198,26 +262,189 @@ class FilterbankFile(object):
     def close(self):
         if self.filfile is not None:
             self.filfile.close()
+        self.data = None
 
     def get_timeslice(self, start, stop):
         startspec = int(np.round(start/self.tsamp))
         stopspec = int(np.round(stop/self.tsamp))
         return self.get_spectra(startspec, stopspec-startspec)
 
-    def get_spectra(self, start, nspec):
-        stop = min(start+nspec, self.nspec)
+    def get_spectra(self, start, nspec, chan_lo=None, chan_hi=None, tdecim=1, \
+                    dtype='float32'):
+        """Return spectra from the file.
+
+            Inputs:
+                start: Index of the first spectrum to read.
+                nspec: Number of spectra to read.
+                chan_lo: Index of the first channel to read.
+                    (Default: first channel in the file)
+                chan_hi: Index of the channel after the last one
+                    to read. (Default: read up to the last channel)
+                tdecim: Number of adjacent spectra to co-add. Excess
+                    spectra at the end are dropped. (Default: 1)
+                dtype: Data type of the returned Spectra. If None,
+                    keep the native sample type (co-added spectra are
+                    then accumulated in float32). (Default: float32)
+
+            Output:
+                spec: A Spectra object.
+
+            Only the selected channels are read (through strided
+            memmap access when the file is memory-mapped), and
+            spectra are co-added block by block while reading.
+        """
+        chan_lo, chan_hi, step = slice(chan_lo, chan_hi).indices(self.nchans)
+        tdecim = int(tdecim)
+        if tdecim < 1:
+            raise ValueError("Time decimation factor must be positive " \
+                             "(%d)!" % tdecim)
+        if (chan_lo, chan_hi, tdecim) == (0, self.nchans, 1):
+            rows = self._read_rows(start, nspec)
+            return self._make_spectra(rows, start, dtype)
+
+        start = int(start)
+        stop = min(start+int(nspec), int(self.nspec))
+        nsel = max(0, chan_hi-chan_lo)
+        nout = max(0, stop-start)//tdecim
+        if tdecim == 1 and self.mmap and self.nbits >= 8:
+            # A strided view of the memmap. No copy is made.
+            rows = self._read_stripe(start, nout, chan_lo, chan_hi)
+        else:
+            if tdecim == 1:
+                rows = np.empty((nout, nsel), dtype=self.dtype)
+            else:
+                rows = np.empty((nout, nsel), dtype=dtype or 'float32')
+            # Number of output spectra per chunk
+            chunk = READ_CHUNK_BYTES // (self.bytes_per_spectrum*tdecim)
+            chunk = max(1, min(chunk, nout))
+            buf = None
+            if not self.mmap:
+                buf = self._alloc_rows(chunk*tdecim)
+            for ii in range(0, nout, chunk):
+                nchunk = min(chunk, nout-ii)
+                stripe = self._read_stripe(start+ii*tdecim, nchunk*tdecim, \
+                                           chan_lo, chan_hi, out=buf)
+                if tdecim == 1:
+                    rows[ii:ii+nchunk] = stripe
+                else:
+                    np.sum(stripe.reshape(nchunk, tdecim, nsel), axis=1, \
+                           dtype=rows.dtype, out=rows[ii:ii+nchunk])
+        return spectra.Spectra(self.freqs[chan_lo:chan_hi], \
+                               self.tsamp*tdecim, rows.T, \
+                               starttime=start*self.tsamp, dm=0.0, dtype=dtype)
+
+    def iter_blocks(self, block_size, overlap=0, prefetch=2, start=0, \
+                    nspec=None, dtype='float32'):
+        """Iterate over the file in blocks of spectra, reading
+            ahead on a background thread.
+
+            Inputs:
+                block_size: Number of new spectra per block.
+                overlap: Number of spectra at the end of each block
+                    that are repeated at the start of the next one.
+                    (Default: 0)
+                prefetch: Number of blocks to read ahead. If 0, read
+                    blocks synchronously. (Default: 2)
+                start: First spectrum to read. (Default: 0)
+                nspec: Number of spectra to read. (Default: read to
+                    the end of the file)
+                dtype: Data type of each block's Spectra. If None,
+                    keep the native sample type. (Default: float32)
+
+            Outputs:
+                blocks: A generator of Spectra objects.
+
+            See blockio.iter_blocks for details.
+        """
+        return blockio.iter_blocks(self, block_size, overlap=overlap, \
+                                   prefetch=prefetch, start=start, nspec=nspec, \
+                                   dtype=dtype)
+
+    def _alloc_rows(self, nspec):
+        return np.empty((nspec, self.nchans), dtype=self.dtype)
+
+    def _read_rows(self, start, nspec, out=None):
+        """Read spectra from the file.
+
+            Inputs:
+                start: Index of the first spectrum to read.
+                nspec: Number of spectra to read.
+                out: Array of shape (>=nspec, nchans) to read the
+                    spectra into. (Default: return a view of the
+                    memmap if the file is memory-mapped, otherwise
+                    return a new array)
+
+            Output:
+                rows: Array of shape (nread, nchans) containing the
+                    spectra. Fewer than 'nspec' spectra are returned
+                    if the end of the file is reached.
+        """
+        start = int(start)
+        stop = min(start+int(nspec), int(self.nspec))
+        nspec = max(0, stop-start)
+        if out is not None:
+            out = out[:nspec]
+        if self.mmap:
+            rows = self.data[start:start+nspec]
+            if self.nbits < 8:
+                rows = bitpacking.unpack(rows, self.nbits, BITORDER, out=out)
+            elif out is not None:
+                out[:] = rows
+                rows = out
+            # Otherwise no copy is made. The data are only
+            # converted when a Spectra operation requires it.
+            return rows
         pos = self.header_size+start*self.bytes_per_spectrum
-        # Compute number of elements to read
-        nspec = int(stop) - int(start)
-        num_to_read = nspec*self.nchans
-        num_to_read = max(0, num_to_read)
-        self.filfile.seek(pos, os.SEEK_SET)
-        spectra_dat = np.fromfile(self.filfile, dtype=self.dtype, 
-                              count=num_to_read)
-        spectra_dat.shape = nspec, self.nchans 
-        spec = spectra.Spectra(self.freqs, self.tsamp, spectra_dat.T,
-                starttime=start*self.tsamp, dm=0.0)
-        return spec
+        with self._lock:
+            self.filfile.seek(pos, os.SEEK_SET)
+            if self.nbits < 8:
+                packed = np.fromfile(self.filfile, dtype='uint8', \
+                                     count=nspec*self.bytes_per_spectrum)
+            elif out is None:
+                rows = np.fromfile(self.filfile, dtype=self.dtype, \
+                                   count=nspec*self.nchans)
+                rows.shape = nspec, self.nchans
+            else:
+                rows = out
+                self.filfile.readinto(rows)
+        if self.nbits < 8:
+            packed.shape = nspec, self.bytes_per_spectrum
+            rows = bitpacking.unpack(packed, self.nbits, BITORDER, out=out)
+        return rows
+
+    def _read_stripe(self, start, nspec, chan_lo, chan_hi, out=None):
+        """Read channels [chan_lo, chan_hi) of 'nspec' spectra
+            starting at spectrum 'start'.
+
+            Inputs:
+                start: Index of the first spectrum to read.
+                nspec: Number of spectra to read.
+                chan_lo: Index of the first channel to read.
+                chan_hi: Index of the channel after the last one.
+                out: Buffer of shape (>=nspec, nchans) used when
+                    reading from the file. (Default: allocate a new
+                    array if needed)
+
+            Output:
+                stripe: Array of shape (nspec, chan_hi-chan_lo). This
+                    may be a view of 'out' or of the memmap.
+        """
+        if self.mmap and self.nbits < 8:
+            # Only unpack the bytes containing the selected channels
+            nper = 8//self.nbits
+            byte_lo = chan_lo//nper
+            byte_hi = -(-chan_hi//nper)
+            packed = self.data[start:start+nspec, byte_lo:byte_hi]
+            rows = bitpacking.unpack(packed, self.nbits, BITORDER)
+            return rows[:, chan_lo-byte_lo*nper:chan_hi-byte_lo*nper]
+        elif self.mmap:
+            return self.data[start:start+nspec, chan_lo:chan_hi]
+        else:
+            return self._read_rows(start, nspec, out=out)[:, chan_lo:chan_hi]
+
+    def _make_spectra(self, rows, start, dtype='float32'):
+        return spectra.Spectra(self.freqs, self.tsamp, rows.T, \
+                               starttime=start*self.tsamp, dm=0.0, dtype=dtype)
 
     def append_spectra(self, spectra):
         """Append spectra to the file if is not read-only.
@@ -242,11 +469,15 @@ class FilterbankFile(object):
         data = spectra.flatten()
         np.clip(data, self.dtype_min, self.dtype_max, out=data)
         # Move to end of file
-        self.filfile.seek(0, os.SEEK_END)
-        self.filfile.write(data.astype(self.dtype))
+        with self._lock:
+            self.filfile.seek(0, os.SEEK_END)
+            self.filfile.write(self._encode(data))
         self.nspec += nspec
         #self.filfile.flush()
         #os.fsync(self.filfile)
+        if self.mmap:
+            self.filfile.flush()
+            self._map_data()
 
     def write_spectra(self, spectra, ispec):
         """Write spectra to the file if is writable.
@@ -278,10 +509,24 @@ class FilterbankFile(object):
         np.clip(data, self.dtype_min, self.dtype_max, out=data)
         # Move to requested position
         pos = self.header_size + ispec*self.bytes_per_spectrum
-        self.filfile.seek(pos, os.SEEK_SET)
-        self.filfile.write(data.astype(self.dtype))
+        with self._lock:
+            self.filfile.seek(pos, os.SEEK_SET)
+            self.filfile.write(self._encode(data))
         if nspec+ispec > self.nspec:
             self.nspec = nspec+ispec
+        if self.mmap:
+            self.filfile.flush()
+            self._map_data()
+
+    def _encode(self, data):
+        """Convert clipped samples to the file's sample format,
+            packing them into bytes if there are fewer than
+            8 bits per sample.
+        """
+        data = data.astype(self.dtype)
+        if self.nbits < 8:
+            data = bitpacking.pack(data, self.nbits, BITORDER)
+        return data
 
     def __getattr__(self, name):
         if name in self.header:
@@ -301,6 +546,308 @@ class FilterbankFile(object):
             print ("%s: %s" % (param, self.header[param]))
 
 
+class FilterbankWriter(object):
+    """Append spectra to a filterbank file through a large
+        buffer that is written out by a background thread.
+
+        Spectra are clipped and converted to the file's sample
+        format as they are appended. While one buffer is being
+        written the other one is filled (double-buffering).
+        The file's 'nspec' (and 'nsamples' header value, if
+        present) is only updated when the writer is closed.
+
+        Usage:
+            with FilterbankWriter(fil) as writer:
+                for block in blocks:
+                    writer.append_spectra(block)
+    """
+    def __init__(self, fil, buffer_size=32*1024**2):
+        """FilterbankWriter constructor.
+
+            Inputs:
+                fil: A FilterbankFile object that is not read-only.
+                buffer_size: Approximate size (in bytes) of each of
+                    the two buffers. (Default: 32 MB)
+        """
+        if fil.filfile.mode.lower() in ('r', 'rb'):
+            raise ValueError("FilterbankFile object for '%s' is read-only." % \
+                        fil.filename)
+        self.fil = fil
+        self.buffer_nspec = max(1, int(buffer_size) // \
+                                   (fil.nchans*np.dtype(fil.dtype).itemsize))
+        self.nspec = 0 # Number of spectra appended so far
+        self.closed = False
+        self._error = None
+        self._nbuffered = 0
+        self._free = queue.Queue()
+        for ii in range(2):
+            self._free.put(fil._alloc_rows(self.buffer_nspec))
+        self._full = queue.Queue()
+        self._buffer = self._free.get()
+        self._thread = threading.Thread(target=self._write_buffers)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Do not hide an exception raised in the 'with' block
+        self.close(raise_errors=exc_type is None)
+
+    def append_spectra(self, spectra):
+        """Append spectra to the file.
+
+            Input:
+                spectra: The spectra to append. The new spectra
+                    must have the correct number of channels (ie
+                    dimension of axis=1.
+
+            Outputs:
+                None
+        """
+        self._check()
+        nspec, nchans = spectra.shape
+        if nchans != self.fil.nchans:
+            raise ValueError("Cannot append spectra. Incorrect shape. " \
+                        "Number of channels in file: %d; Number of " \
+                        "channels in spectra to append: %d" % \
+                        (self.fil.nchans, nchans))
+        ispec = 0
+        while ispec < nspec:
+            ncopy = min(nspec-ispec, self.buffer_nspec-self._nbuffered)
+            dest = self._buffer[self._nbuffered:self._nbuffered+ncopy]
+            dest[:] = np.clip(spectra[ispec:ispec+ncopy], \
+                              self.fil.dtype_min, self.fil.dtype_max)
+            self._nbuffered += ncopy
+            ispec += ncopy
+            if self._nbuffered == self.buffer_nspec:
+                self.flush()
+        self.nspec += nspec
+
+    def flush(self):
+        """Hand the buffered spectra to the writer thread and
+            continue with the other buffer.
+        """
+        if self._nbuffered:
+            self._full.put((self._buffer, self._nbuffered))
+            self._buffer = self._free.get()
+            self._nbuffered = 0
+        self._check()
+
+    def close(self, raise_errors=True):
+        """Write out all buffered spectra, wait for the writer
+            thread and update the file's number of spectra.
+
+            Input:
+                raise_errors: If True, raise the error that stopped
+                    the writer thread, if any. Otherwise only warn
+                    about it (e.g. when closing the writer while
+                    another exception is being handled).
+                    (Default: True)
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self._nbuffered and self._error is None:
+            self._full.put((self._buffer, self._nbuffered))
+        self._full.put(None)
+        self._thread.join()
+        self._buffer = None
+        if self._error is not None:
+            if raise_errors:
+                raise self._error
+            warnings.warn("Error while writing '%s' (%s)" % \
+                          (self.fil.filename, self._error))
+            return
+        fil = self.fil
+        with fil._lock:
+            fil.filfile.flush()
+            fil.nspec += self.nspec
+            if 'nsamples' in fil.header:
+                fil.header['nsamples'] = int(fil.nspec)
+                self._update_nsamples()
+        if fil.mmap:
+            fil._map_data()
+
+    def _check(self):
+        if self.closed:
+            raise ValueError("FilterbankWriter for '%s' is closed." % \
+                             self.fil.filename)
+        if self._error is not None:
+            raise self._error
+
+    def _write_buffers(self):
+        # Runs on the background thread
+        fil = self.fil
+        while True:
+            item = self._full.get()
+            if item is None:
+                break
+            buf, nspec = item
+            if self._error is None:
+                try:
+                    data = buf[:nspec]
+                    if fil.nbits < 8:
+                        data = bitpacking.pack(data, fil.nbits, BITORDER)
+                    with fil._lock:
+                        fil.filfile.seek(0, os.SEEK_END)
+                        fil.filfile.write(data)
+                except Exception as err:
+                    self._error = err
+            self._free.put(buf)
+
+    def _update_nsamples(self):
+        # Overwrite the 'nsamples' value in the header on disk
+        hdrfile = open(self.fil.filename, 'r+b')
+        hdr = hdrfile.read(self.fil.header_size)
+        key = sigproc.prep_string("nsamples")
+        pos = hdr.find(key)
+        if pos >= 0:
+            hdrfile.seek(pos+len(key), os.SEEK_SET)
+            hdrfile.write(struct.pack('i', int(self.fil.nspec)))
+        hdrfile.close()
+
+
+class FilterbankSeries(object):
+    """A set of consecutive filterbank files (e.g. an observation
+        written out in several pieces) that can be read as a
+        single file.
+    """
+    def __init__(self, filfns, mmap=False):
+        """FilterbankSeries constructor.
+
+            Inputs:
+                filfns: A list of the filterbank files' names, in
+                    chronological order.
+                mmap: If True, memory-map each file. See FilterbankFile.
+                    (Default: read spectra from the files)
+
+            The headers of all files must have the same 'fch1',
+            'foff', 'nchans', 'nbits' and 'tsamp', and each file must
+            start where the previous one ends ('tstart').
+        """
+        if not len(filfns):
+            raise ValueError("No filterbank files provided!")
+        self.filenames = list(filfns)
+        self.files = [FilterbankFile(fn, mmap=mmap) for fn in self.filenames]
+        self.check_headers()
+        self.header = self.files[0].header
+        self.frequencies = self.files[0].frequencies
+        self.dtype = self.files[0].dtype
+        # Global index of the first spectrum of each file. The last
+        # entry is the total number of spectra.
+        nspecs = [int(fil.nspec) for fil in self.files]
+        self.offsets = np.concatenate(([0], np.cumsum(nspecs))).astype('int')
+        self.nspec = int(self.offsets[-1])
+
+    def check_headers(self):
+        """Make sure all files can be read as a single file.
+            A ValueError is raised if they can't.
+        """
+        first = self.files[0]
+        for ii, fil in enumerate(self.files[1:], 1):
+            for param in ('fch1', 'foff', 'nchans', 'nbits', 'tsamp'):
+                if fil.header.get(param) != first.header.get(param):
+                    raise ValueError("Header parameter '%s' differs between " \
+                                     "files '%s' (%s) and '%s' (%s)!" % \
+                                     (param, first.filename, \
+                                      first.header.get(param), \
+                                      fil.filename, fil.header.get(param)))
+            prev = self.files[ii-1]
+            expected = prev.tstart + prev.nspec*prev.tsamp/SECPERDAY
+            if abs(fil.tstart-expected)*SECPERDAY > 0.5*fil.tsamp:
+                raise ValueError("File '%s' does not start where '%s' " \
+                                 "ends (tstart: %.12f, expected: %.12f)!" % \
+                                 (fil.filename, prev.filename, \
+                                  fil.tstart, expected))
+
+    @property
+    def freqs(self):
+        # Alias for frequencies
+        return self.frequencies
+
+    @property
+    def nchan(self):
+        # more aliases..
+        return self.nchans
+
+    def close(self):
+        for fil in self.files:
+            fil.close()
+
+    def get_timeslice(self, start, stop):
+        startspec = int(np.round(start/self.tsamp))
+        stopspec = int(np.round(stop/self.tsamp))
+        return self.get_spectra(startspec, stopspec-startspec)
+
+    def get_spectra(self, start, nspec, dtype='float32'):
+        """Return spectra, possibly spanning several files.
+
+            Inputs:
+                start: Global index of the first spectrum to read.
+                nspec: Number of spectra to read.
+                dtype: Data type of the returned Spectra. If None,
+                    keep the native sample type. (Default: float32)
+
+            Output:
+                spec: A Spectra object.
+        """
+        rows = self._read_rows(start, nspec)
+        return self._make_spectra(rows, start, dtype)
+
+    def iter_blocks(self, block_size, overlap=0, prefetch=2, start=0, \
+                    nspec=None, dtype='float32'):
+        """Iterate over all files in blocks of spectra. Blocks
+            span file boundaries. See FilterbankFile.iter_blocks.
+        """
+        return blockio.iter_blocks(self, block_size, overlap=overlap, \
+                                   prefetch=prefetch, start=start, nspec=nspec, \
+                                   dtype=dtype)
+
+    def _alloc_rows(self, nspec):
+        return np.empty((nspec, self.nchans), dtype=self.dtype)
+
+    def _read_rows(self, start, nspec, out=None):
+        """Read spectra, stitching them together across file
+            boundaries. See FilterbankFile._read_rows.
+        """
+        start = int(start)
+        stop = min(start+int(nspec), self.nspec)
+        nspec = max(0, stop-start)
+        ifile = np.searchsorted(self.offsets, start, side='right')-1
+        ifile = max(0, min(ifile, len(self.files)-1))
+        if out is None and stop <= self.offsets[ifile+1]:
+            # All spectra are in a single file. Let it decide
+            # whether a copy is needed.
+            return self.files[ifile]._read_rows(start-self.offsets[ifile], \
+                                                nspec)
+        if out is None:
+            out = self._alloc_rows(nspec)
+        rows = out[:nspec]
+        pos = start
+        while pos < stop:
+            lo = pos-self.offsets[ifile]
+            nread = min(self.offsets[ifile+1], stop)-pos
+            self.files[ifile]._read_rows(lo, nread, \
+                                         out=rows[pos-start:pos-start+nread])
+            pos += nread
+            ifile += 1
+        return rows
+
+    def _make_spectra(self, rows, start, dtype='float32'):
+        return spectra.Spectra(self.freqs, self.tsamp, rows.T, \
+                               starttime=start*self.tsamp, dm=0.0, dtype=dtype)
+
+    def __getattr__(self, name):
+        if name in self.header:
+            val = self.header[name]
+        else:
+            raise ValueError("No FilterbankSeries attribute called '%s'" % \
+                             name)
+        return val
+
+
 def main():
     fil = FilterbankFile(sys.argv[1])
     fil.print_header()
@@ -0,0 +1,111 @@
+"""
+An on-disk cache of parsed file headers.
+
+Entries are keyed by the file's absolute path and are only reused if
+the file's size and modification time have not changed since it was
+parsed. This makes repeated scans of large archives cheap.
+
+Index files are pickles, so only indices written by the current user
+should be loaded. By default they are kept in a per-user cache
+directory (see 'get_user_indexfn') rather than next to the data.
+"""
+
+import os
+import os.path
+import warnings
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+def get_user_indexfn(name):
+    """Return the name of an index file in the current user's
+        cache directory ($XDG_CACHE_HOME, or ~/.cache if it is
+        not set).
+
+        Input:
+            name: Base name of the index file.
+
+        Output:
+            indexfn: Full name of the index file.
+    """
+    cachedir = os.environ.get('XDG_CACHE_HOME') or \
+                os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cachedir, 'presto_python', name)
+
+
+class HeaderIndex(object):
+    def __init__(self, indexfn):
+        """HeaderIndex constructor.
+
+            Input:
+                indexfn: Name of the index file. It is created when
+                    the index is first saved.
+        """
+        self.indexfn = indexfn
+        self.entries = {} # path -> (size, mtime, value)
+        self.modified = False
+        if os.path.isfile(indexfn):
+            try:
+                with open(indexfn, 'rb') as indexfile:
+                    self.entries = pickle.load(indexfile)
+            except Exception:
+                warnings.warn("Could not load header index '%s'. " \
+                              "It will be rebuilt." % indexfn)
+                self.entries = {}
+
+    def get(self, path, parse):
+        """Return the parsed header of a file, using the
+            cached value if the file is unchanged.
+
+            Inputs:
+                path: Name of the file.
+                parse: A function that takes the file's name and
+                    returns the value to cache.
+
+            Output:
+                value: The (possibly cached) value returned by 'parse'.
+        """
+        key = os.path.abspath(path)
+        stat = os.stat(key)
+        cached = self.entries.get(key)
+        if cached is not None and cached[0] == stat.st_size and \
+                cached[1] == stat.st_mtime:
+            return cached[2]
+        value = parse(path)
+        self.entries[key] = (stat.st_size, stat.st_mtime, value)
+        self.modified = True
+        return value
+
+    def scan(self, paths, parse):
+        """Return a dictionary mapping each path to its
+            parsed header, then save the index if it changed.
+            See 'HeaderIndex.get'.
+        """
+        results = {}
+        for path in paths:
+            results[path] = self.get(path, parse)
+        self.save()
+        return results
+
+    def save(self):
+        """Write the index to disk if it has changed. A warning
+            is issued if the index cannot be written.
+        """
+        if not self.modified:
+            return
+        tmpfn = "%s.tmp%d" % (self.indexfn, os.getpid())
+        try:
+            indexdir = os.path.dirname(os.path.abspath(self.indexfn))
+            if not os.path.isdir(indexdir):
+                os.makedirs(indexdir)
+            with open(tmpfn, 'wb') as indexfile:
+                pickle.dump(self.entries, indexfile, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmpfn, self.indexfn)
+        except (IOError, OSError) as err:
+            warnings.warn("Could not write header index '%s' (%s)" % \
+                          (self.indexfn, err))
+            return
+        self.modified = False
@@ -848,6 +848,7 @@ def inject(infile, outfn, prof, period, dm, nbitsout=None,
     # Create the output filterbank file
     if nbitsout is None:
         nbitsout = fil.nbits
+    writer = None
     if inplace:
         warnings.warn("Injecting pulsar signal *in-place*")
         outfil = fil
@@ -856,74 +857,81 @@ def inject(infile, outfn, prof, period, dm, nbitsout=None,
         print "Creating out file: %s" % outfn
         outfil = filterbank.create_filterbank_file(outfn, fil.header, \
                                             nbits=nbitsout, mode='append')
-
-    if outfil.nbits == 8:
-        raise NotImplementedError("This code is out of date. 'delays' is not " \
-                                    "done in this way anymore..")
-        # Read the first second of data to get the global scaling to use
-        onesec = fil.get_timeslice(0, 1).copy()
-        onesec_nspec = onesec.shape[0]
-        times = np.atleast_2d(np.arange(onesec_nspec)*fil.tsamp).T+delays
-        phases = times/period % 1
-        onesec += prof(phases)
-        minimum = np.min(onesec)
-        median = np.median(onesec)
-        # Set median to 1/3 of dynamic range
-        global_scale = (256.0/3.0) / median
-        del onesec
-    else:
-        # No scaling to be performed
-        # These values will cause scaling to keep data unchanged
-        minimum = 0
-        global_scale = 1
-
-    sys.stdout.write(" %3.0f %%\r" % 0)
-    sys.stdout.flush()
-    oldprogress = -1
-    
-    # Loop over data
-    lobin = 0
-    spectra = fil.get_spectra(0, block_size)
-    numread = spectra.shape[0]
-    while numread:
-        if pulsar_only:
-            # Do not write out data from input file
-            # zero it out
-            spectra *= 0
-        hibin = lobin+numread
-        # Sample at middle of time bin
-        times = (np.arange(lobin, hibin, 1.0/NINTEG_PER_BIN)+0.5/NINTEG_PER_BIN)*fil.dt
-        #times = (np.arange(lobin, hibin)+0.5)*fil.dt
-        phases = get_phases(times)
-        profvals = prof(phases)
-        shape = list(profvals.shape)
-        shape[1:1] = [NINTEG_PER_BIN]
-        shape[0] /= NINTEG_PER_BIN
-        profvals.shape = shape
-        toinject = profvals.mean(axis=1)
-        #toinject = profvals
-        if np.ndim(toinject) > 1:
-            injected = spectra+toinject
-        else:
-            injected = spectra+toinject[:,np.newaxis]
-        scaled = (injected-minimum)*global_scale
-        if inplace:
-            outfil.write_spectra(scaled, lobin)
+        writer = filterbank.FilterbankWriter(outfil)
+
+    try:
+        if outfil.nbits == 8:
+            raise NotImplementedError("This code is out of date. 'delays' is not " \
+                                        "done in this way anymore..")
+            # Read the first second of data to get the global scaling to use
+            onesec = fil.get_timeslice(0, 1).copy()
+            onesec_nspec = onesec.shape[0]
+            times = np.atleast_2d(np.arange(onesec_nspec)*fil.tsamp).T+delays
+            phases = times/period % 1
+            onesec += prof(phases)
+            minimum = np.min(onesec)
+            median = np.median(onesec)
+            # Set median to 1/3 of dynamic range
+            global_scale = (256.0/3.0) / median
+            del onesec
         else:
-            outfil.append_spectra(scaled)
+            # No scaling to be performed
+            # These values will cause scaling to keep data unchanged
+            minimum = 0
+            global_scale = 1
+
+        sys.stdout.write(" %3.0f %%\r" % 0)
+        sys.stdout.flush()
+        oldprogress = -1
+    
+        # Loop over data
+        lobin = 0
+        for block in fil.iter_blocks(block_size):
+            spectra = block.data.T
+            numread = spectra.shape[0]
+            if pulsar_only:
+                # Do not write out data from input file
+                # zero it out
+                spectra *= 0
+            hibin = lobin+numread
+            # Sample at middle of time bin
+            times = (np.arange(lobin, hibin, 1.0/NINTEG_PER_BIN)+0.5/NINTEG_PER_BIN)*fil.dt
+            #times = (np.arange(lobin, hibin)+0.5)*fil.dt
+            phases = get_phases(times)
+            profvals = prof(phases)
+            shape = list(profvals.shape)
+            shape[1:1] = [NINTEG_PER_BIN]
+            shape[0] /= NINTEG_PER_BIN
+            profvals.shape = shape
+            toinject = profvals.mean(axis=1)
+            #toinject = profvals
+            if np.ndim(toinject) > 1:
+                injected = spectra+toinject
+            else:
+                injected = spectra+toinject[:,np.newaxis]
+            scaled = (injected-minimum)*global_scale
+            if inplace:
+                outfil.write_spectra(scaled, lobin)
+            else:
+                writer.append_spectra(scaled)
         
-        # Print progress to screen
-        progress = int(100.0*hibin/fil.nspec)
-        if progress > oldprogress: 
-            sys.stdout.write(" %3.0f %%\r" % progress)
-            sys.stdout.flush()
-            oldprogress = progress
+            # Print progress to screen
+            progress = int(100.0*hibin/fil.nspec)
+            if progress > oldprogress: 
+                sys.stdout.write(" %3.0f %%\r" % progress)
+                sys.stdout.flush()
+                oldprogress = progress
         
-        # Prepare for next iteration
-        lobin = hibin 
-        spectra = fil.get_spectra(lobin, block_size)
-        numread = spectra.shape[0]
-
+            # Prepare for next iteration
+            lobin = hibin 
+    except:
+        # Flush and close the output file, without hiding the
+        # error that stopped the injection
+        if writer is not None:
+            writer.close(raise_errors=False)
+        raise
+    if writer is not None:
+        writer.close()
     sys.stdout.write("Done   \n")
     sys.stdout.flush()
 
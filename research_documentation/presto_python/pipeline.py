@@ -0,0 +1,273 @@
+"""
+Lazy, fused execution of a sequence of Spectra operations.
+
+A SpectraPipeline records the operations usually applied one after the
+other to a spectra.Spectra object (e.g. by waterfaller.waterfall) and
+then runs them in a single pass over blocks of channels. Each block is
+masked, shifted and summed into subbands in one gather-sum, dedispersed
+and downsampled straight into the output array, while the statistics
+needed for scaling are collected. Only the (smaller) output is
+revisited to apply the scaling and smoothing. Peak memory is thus
+bounded by the block size and the size of the output, rather than by
+the number of operations.
+
+Operations must be recorded in the order:
+    masked, subband, dedisperse, downsample, scaled, smooth
+and each can only be recorded once.
+"""
+
+import numpy as np
+
+import psr_utils
+import spectra
+
+# Approximate number of input samples processed per block
+BLOCK_SIZE = 2**22
+
+# Operations in the order they are applied
+OPERATIONS = ['masked', 'subband', 'dedisperse', 'downsample', \
+              'scaled', 'smooth']
+
+
+class SpectraPipeline(object):
+    def __init__(self, spec):
+        """SpectraPipeline constructor.
+
+            Input:
+                spec: The Spectra object to process. It is not modified.
+
+            Output:
+                pipeline: The SpectraPipeline object. Operations are
+                    recorded by calling its methods, which have the
+                    same arguments as the Spectra methods of the same
+                    names, and are run by calling 'execute'.
+        """
+        self.spec = spec
+        self.ops = {}
+
+    def _record(self, name, **kwargs):
+        """Record an operation and return the pipeline.
+        """
+        if name in self.ops:
+            raise ValueError("Operation '%s' has already been recorded!" % \
+                             name)
+        later = [op for op in OPERATIONS[OPERATIONS.index(name)+1:] \
+                 if op in self.ops]
+        if later:
+            raise ValueError("Operation '%s' must be recorded before '%s'!" % \
+                             (name, later[0]))
+        self.ops[name] = kwargs
+        return self
+
+    def masked(self, mask, maskval='median-mid80', startsamp=None):
+        """Record masking. See Spectra.masked."""
+        return self._record('masked', mask=mask, maskval=maskval, \
+                            startsamp=startsamp)
+
+    def subband(self, nsub, subdm=None, padval=0):
+        """Record subbanding. See Spectra.subband."""
+        if self.spec.numchans % nsub:
+            raise ValueError("Number of subbands (%d) is not a factor of " \
+                             "the number of channels (%d)!" % \
+                             (nsub, self.spec.numchans))
+        assert (subdm is None) or (subdm >= 0)
+        return self._record('subband', nsub=nsub, subdm=subdm, padval=padval)
+
+    def dedisperse(self, dm=0, padval=0):
+        """Record dedispersion. See Spectra.dedisperse."""
+        assert dm >= 0
+        return self._record('dedisperse', dm=dm, padval=padval)
+
+    def downsample(self, factor=1):
+        """Record downsampling (excess spectra are trimmed).
+            See Spectra.downsample.
+        """
+        return self._record('downsample', factor=int(factor))
+
+    def scaled(self, indep=False):
+        """Record scaling. See Spectra.scaled."""
+        return self._record('scaled', indep=indep)
+
+    def smooth(self, width=1, padval=0):
+        """Record smoothing. See Spectra.smooth."""
+        return self._record('smooth', width=width, padval=padval)
+
+    def execute(self, block_size=BLOCK_SIZE):
+        """Run the recorded operations.
+
+            Input:
+                block_size: Approximate number of input samples
+                    processed at a time. (Default: BLOCK_SIZE)
+
+            Output:
+                result: A new Spectra object.
+        """
+        spec = self.spec
+        ops = self.ops
+        nspec = spec.numspectra
+
+        # Channels are summed into 'nout' output channels
+        if 'subband' in ops:
+            nout = ops['subband']['nsub']
+        else:
+            nout = spec.numchans
+        chans_per_out = spec.numchans//nout
+        outfreqs = spec.freqs.reshape(nout, chans_per_out)
+        outfreqs = 0.5*(outfreqs[:,0]+outfreqs[:,-1])
+
+        # Relative delays (in bins) when subbanding
+        subshifts = None
+        if 'subband' in ops and ops['subband']['subdm'] is not None:
+            subdm = ops['subband']['subdm']
+            ref_delays = psr_utils.delay_from_DM(subdm-spec.dm, outfreqs)
+            delays = psr_utils.delay_from_DM(subdm-spec.dm, spec.freqs)
+            rel_delays = delays-ref_delays.repeat(chans_per_out)
+            subshifts = np.round(rel_delays/spec.dt).astype('int')
+
+        # Relative delays (in bins) of the output channels
+        dmshifts = None
+        outdm = spec.dm
+        if 'dedisperse' in ops:
+            outdm = ops['dedisperse']['dm']
+            ref_delay = psr_utils.delay_from_DM(outdm-spec.dm, \
+                                                np.max(outfreqs))
+            delays = psr_utils.delay_from_DM(outdm-spec.dm, outfreqs)
+            dmshifts = np.round((delays-ref_delay)/spec.dt).astype('int')
+
+        factor = ops.get('downsample', {'factor': 1})['factor']
+        nspec_out = nspec//factor
+
+        # Masks given as rfifind objects are converted block by block
+        maskblocks = None
+        if 'masked' in ops and \
+                hasattr(ops['masked']['mask'], 'mask_zap_chans_per_int'):
+            startsamp = ops['masked']['startsamp']
+            if startsamp is None:
+                startsamp = int(np.round(spec.starttime/spec.dt))
+            maskblocks = spec._get_rfifind_blocks(ops['masked']['mask'], \
+                                                  startsamp)
+
+        # Sums of native integer samples are stored as floats
+        if 'subband' in ops or factor > 1:
+            outdtype = spectra.get_sum_dtype(spec.dtype)
+        else:
+            outdtype = spec.dtype
+        if 'scaled' in ops:
+            outdtype = np.result_type(outdtype, np.float32)
+        out = np.empty((nout, nspec_out), dtype=outdtype)
+        medians = np.zeros(nout)
+        stds = np.ones(nout)
+        sumsq = total = 0.0
+        nout_per_block = max(1, block_size//max(1, nspec*chans_per_out))
+        for olo in range(0, nout, nout_per_block):
+            ohi = min(nout, olo+nout_per_block)
+            clo, chi = olo*chans_per_out, ohi*chans_per_out
+
+            rows = spec[clo:chi]
+            if not rows.flags.owndata:
+                # Never modify the data of 'spec'
+                rows = rows.copy()
+            block = spectra.Spectra(spec.freqs[clo:chi], spec.dt, rows, \
+                                    starttime=spec.starttime, \
+                                    dtype=spec.dtype)
+            block.data = rows # Already converted. Avoid another copy.
+            block.dm = spec.dm
+
+            if 'masked' in ops:
+                if maskblocks is not None:
+                    mask = np.zeros((chi-clo, nspec), dtype='bool')
+                    for lo, hi, chans in maskblocks:
+                        chans = chans[(chans >= clo) & (chans < chi)]
+                        mask[chans-clo,lo:hi] = True
+                else:
+                    mask = ops['masked']['mask'][clo:chi]
+                block.masked(mask, maskval=ops['masked']['maskval'])
+
+            if 'subband' in ops:
+                shifts = None
+                if subshifts is not None:
+                    shifts = subshifts[clo:chi]
+                rows = self._gather_sum(block.data, shifts, chans_per_out, \
+                                        ops['subband']['padval'])
+                block = spectra.Spectra(outfreqs[olo:ohi], spec.dt, rows, \
+                                        starttime=spec.starttime, \
+                                        dtype=rows.dtype)
+                block.data = rows
+                block.dm = spec.dm
+
+            if dmshifts is not None:
+                block.shift_channels(dmshifts[olo:ohi], \
+                                     ops['dedisperse']['padval'])
+
+            # Downsample straight into the output
+            dest = out[olo:ohi]
+            full = block.data[:,:nspec_out*factor]
+            np.sum(full.reshape(ohi-olo, nspec_out, factor), axis=2, \
+                   dtype=dest.dtype, out=dest)
+
+            # Collect the statistics needed to scale the output
+            if 'scaled' in ops:
+                medians[olo:ohi] = np.median(dest, axis=1)
+                if ops['scaled']['indep']:
+                    stds[olo:ohi] = dest.std(axis=1)
+                else:
+                    total += dest.sum(dtype='float64')
+                    sumsq += np.square(dest, dtype='float64').sum()
+
+        result = spectra.Spectra(outfreqs, spec.dt*factor, out, \
+                                 starttime=spec.starttime, dtype=outdtype)
+        result.data = out
+        result.dm = outdm
+        if 'scaled' in ops:
+            if not ops['scaled']['indep'] and out.size:
+                mean = total/out.size
+                stds[:] = np.sqrt(max(sumsq/out.size - mean**2, 0))
+            out -= medians[:,np.newaxis].astype(out.dtype)
+            out /= stds[:,np.newaxis].astype(out.dtype)
+        if 'smooth' in ops:
+            result.smooth(ops['smooth']['width'], ops['smooth']['padval'])
+        return result
+
+    def _gather_sum(self, data, shifts, chans_per_out, padval):
+        """Shift channels and sum them into subbands in one pass,
+            without storing the shifted channels.
+
+            Inputs:
+                data: A (nchan, nspec) array of channels.
+                shifts: Number of bins to shift each channel to
+                    the left by, or None.
+                chans_per_out: Number of channels per subband.
+                padval: The padding value. See Spectra.shift_channels.
+
+            Output:
+                subbands: A (nchan/chans_per_out, nspec) array.
+        """
+        nchan, nspec = data.shape
+        nout = nchan//chans_per_out
+        sumdtype = spectra.get_sum_dtype(data.dtype)
+        if shifts is None or nspec == 0:
+            return data.reshape(nout, chans_per_out, nspec).sum(axis=1, \
+                                                               dtype=sumdtype)
+        subbands = np.zeros((nout, nspec), dtype=sumdtype)
+        if padval=='mean':
+            pads = np.mean(data, axis=1)
+        elif padval=='median':
+            pads = np.median(data, axis=1)
+        elif padval!='rotate':
+            pads = np.empty(nchan)
+            pads[:] = padval
+        for ii in range(nchan):
+            sub = subbands[ii//chans_per_out]
+            chan = data[ii]
+            shift = shifts[ii] % nspec if padval=='rotate' else shifts[ii]
+            if shift >= nspec or shift <= -nspec:
+                sub += pads[ii]
+            elif shift >= 0:
+                sub[:nspec-shift] += chan[shift:]
+                if shift:
+                    sub[nspec-shift:] += chan[:shift] if padval=='rotate' \
+                                            else pads[ii]
+            else:
+                sub[-shift:] += chan[:nspec+shift]
+                sub[:-shift] += pads[ii]
+        return subbands
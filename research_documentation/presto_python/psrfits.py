@@ -10,10 +10,14 @@ Last Updated: Jul 4, 2016 (Scott Ransom to add 2-bit reading)
 """
 import re
 import os
+import collections
+import mmap
+import multiprocessing
 import os.path
 import warnings
 import sys
 import argparse
+import threading
 
 import astropy.io.fits as pyfits
 from astropy import coordinates, units
@@ -21,6 +25,9 @@ import astropy.time as aptime
 import numpy as np
 import psr_utils
 import spectra
+import blockio
+import bitpacking
+import headerindex
 
 # Regular expression for parsing DATE-OBS card's format.
 date_obs_re = re.compile(r"^(?P<year>[0-9]{4})-(?P<month>[0-9]{2})-" \
@@ -31,6 +38,34 @@ date_obs_re = re.compile(r"^(?P<year>[0-9]{4})-(?P<month>[0-9]{2})-" \
 # Default global debugging mode
 debug = True 
 
+# Size (in bytes) of FITS header blocks and of the cards within them
+FITS_BLOCK_SIZE = 2880
+FITS_CARD_SIZE = 80
+
+# Binary table column types: (size in bytes, numpy dtype or None)
+# 'X' columns are handled separately since they hold bits.
+FITS_COLUMN_TYPES = {'L': (1, None), 'A': (1, None), 'B': (1, 'u1'), \
+                     'I': (2, '>i2'), 'J': (4, '>i4'), 'K': (8, '>i8'), \
+                     'E': (4, '>f4'), 'D': (8, '>f8'), 'C': (8, None), \
+                     'M': (16, None), 'P': (8, None), 'Q': (16, None)}
+tform_re = re.compile(r"^\s*(?P<repeat>[0-9]*)(?P<type>[LXBIJKAEDCMPQ])")
+
+# SUBINT columns whose first row is read by 'scan_psrfits'
+SCANNED_COLUMNS = ['TEL_AZ', 'TEL_ZEN', 'DAT_FREQ', 'DAT_WTS', \
+                   'DAT_OFFS', 'DAT_SCL']
+
+# Number of files a PsrfitsSeries keeps open at a time
+MAX_OPEN_FILES = 4
+
+# Number of samples transposed at a time when decoding subints
+# into (nchan, nsamp) arrays
+TRANSPOSE_BLOCK_SIZE = 128
+
+# File and shared output array of each parallel decoding worker
+# (see PsrfitsFile._read_parallel)
+_decode_file = None
+_decode_out = None
+
 def unpack_2bit(data):
     """Unpack 2-bit data that has been read in as bytes.
 
@@ -42,11 +77,7 @@ def unpack_2bit(data):
             outdata: unpacked array. The size of this array will 
                 be four times the size of the input data.
     """
-    piece0 = np.bitwise_and(data >> 0x06, 0x03)
-    piece1 = np.bitwise_and(data >> 0x04, 0x03)
-    piece2 = np.bitwise_and(data >> 0x02, 0x03)
-    piece3 = np.bitwise_and(data, 0x03)
-    return np.dstack([piece0, piece1, piece2, piece3]).flatten()
+    return bitpacking.unpack(data, 2).flatten()
 
 def unpack_4bit(data):
     """Unpack 4-bit data that has been read in as bytes.
@@ -59,12 +90,60 @@ def unpack_4bit(data):
             outdata: unpacked array. The size of this array will 
                 be twice the size of the input data.
     """
-    piece0 = np.bitwise_and(data >> 0x04, 0x0F)
-    piece1 = np.bitwise_and(data, 0x0F)
-    return np.dstack([piece0, piece1]).flatten()
+    return bitpacking.unpack(data, 4).flatten()
+
+def transpose_into(rows, out):
+    """Copy a (nsamp, nchan) array into a (nchan, nsamp) array.
+        Samples are copied a block at a time, which is faster than
+        a single transposed copy for large numbers of channels.
+    """
+    for lo in range(0, len(rows), TRANSPOSE_BLOCK_SIZE):
+        hi = lo+TRANSPOSE_BLOCK_SIZE
+        out[:,lo:hi] = rows[lo:hi].T
+
+def _init_decode_worker(filename, precombine, buf, shape):
+    """Open the file and wrap the shared output buffer in a
+        parallel decoding worker.
+    """
+    global _decode_file, _decode_out
+    _decode_file = PsrfitsFile(filename, precombine=precombine)
+    _decode_out = _decode_file._flip_channels( \
+                    np.frombuffer(buf, dtype=np.float32).reshape(shape))
+
+def uses_fork():
+    """Return True if multiprocessing starts its worker processes
+        by forking, so that they inherit anonymous memory maps.
+    """
+    get_start_method = getattr(multiprocessing, 'get_start_method', None)
+    if get_start_method is None:
+        # Python 2 forks wherever os.fork is available
+        return hasattr(os, 'fork')
+    return get_start_method() == 'fork'
+
+
+def _decode_subint(task):
+    """Decode samples 'skip' to 'skip+nuse' of subint 'isub' into
+        the columns of the shared output starting at 'pos'.
+    """
+    isub, skip, nuse, pos = task
+    data = _decode_file.read_subint(isub)
+    transpose_into(data[skip:skip+nuse], _decode_out[:,pos:pos+nuse])
 
 class PsrfitsFile(object):
-    def __init__(self, psrfitsfn):
+    def __init__(self, psrfitsfn, precombine=True):
+        """PsrfitsFile constructor.
+
+            Inputs:
+                psrfitsfn: Name of the PSRFITS file.
+                precombine: If True, multiply the scales and offsets
+                    by the weights once, so that each subint is
+                    calibrated with a single multiply-add. The result
+                    differs from applying scales, offsets and weights
+                    in turn only by float32 rounding. (Default: True)
+
+            Output:
+                pfits: The PsrfitsFile object.
+        """
         if not os.path.isfile(psrfitsfn):
             raise ValueError("ERROR: File does not exist!\n\t(%s)" % \
                                 psrfitsfn)
@@ -82,6 +161,15 @@ class PsrfitsFile(object):
         self.frequencies = self.freqs # Alias
         self.tsamp = self.specinfo.dt
         self.nspec = self.specinfo.N
+        self._unpacked = None # Buffer for unpacking sub-byte samples
+        # Serialise use of the unpacking buffer between the caller
+        # and background read-ahead threads (see 'iter_blocks')
+        self._lock = threading.Lock()
+        self.precombine = precombine
+        # (nsubint, nchan) float32 arrays of the DAT_SCL, DAT_OFFS and
+        # DAT_WTS columns. They are read when first needed.
+        self._columns = None
+        self._coeffs = {} # Calibration arrays used by 'read_subint'
 
     def read_subint(self, isub, apply_weights=True, apply_scales=True, \
                     apply_offsets=True):
@@ -102,40 +190,93 @@ class PsrfitsFile(object):
                 data: Subint data with scales, weights, and offsets
                      applied in float32 dtype with shape (nsamps,nchan).
         """ 
-        sdata = self.fits['SUBINT'].data[isub]['DATA']
-        shp = sdata.squeeze().shape
-        if self.nbits < 8: # Unpack the bytes data
-            if (shp[0] != self.nsamp_per_subint) and \
-                    (shp[1] != self.nchan * self.nbits / 8):
-                sdata = sdata.reshape(self.nsamp_per_subint,
-                                      self.nchan * self.nbits / 8)
-            if self.nbits == 4: data = unpack_4bit(sdata)
-            elif self.nbits == 2: data = unpack_2bit(sdata)
-            else: data = np.asarray(sdata)
-        else:
-            # Handle 4-poln GUPPI/PUPPI data
-            if (len(shp)==3 and shp[1]==self.npoln and
-                self.poln_order=="AABBCRCI"):
-                warnings.warn("Polarization is AABBCRCI, summing AA and BB")
-                data = np.zeros((self.nsamp_per_subint,
-                                 self.nchan), dtype=np.float32)
-                data += sdata[:,0,:].squeeze()
-                data += sdata[:,1,:].squeeze()
-            elif (len(shp)==3 and shp[1]==self.npoln and
-                self.poln_order=="IQUV"):
-                warnings.warn("Polarization is IQUV, just using Stokes I")
-                data = np.zeros((self.nsamp_per_subint,
-                                 self.nchan), dtype=np.float32)
-                data += sdata[:,0,:].squeeze()
+        with self._lock:
+            sdata = self.fits['SUBINT'].data[isub]['DATA']
+            shp = sdata.squeeze().shape
+            if self.nbits < 8: # Unpack the bytes data
+                if (shp[0] != self.nsamp_per_subint) and \
+                        (shp[1] != self.nchan * self.nbits / 8):
+                    sdata = sdata.reshape(self.nsamp_per_subint,
+                                          self.nchan * self.nbits / 8)
+                if self._unpacked is None or \
+                        self._unpacked.size != sdata.size*8//self.nbits:
+                    self._unpacked = np.empty(sdata.size*8//self.nbits, \
+                                              dtype=np.uint8)
+                data = bitpacking.unpack(sdata.ravel(), self.nbits, \
+                                         out=self._unpacked)
             else:
-                data = np.asarray(sdata)
-        data = data.reshape((self.nsamp_per_subint, 
-                             self.nchan)).astype(np.float32)
-        if apply_scales: data *= self.get_scales(isub)[:self.nchan]
-        if apply_offsets: data += self.get_offsets(isub)[:self.nchan]
-        if apply_weights: data *= self.get_weights(isub)[:self.nchan]
+                # Handle 4-poln GUPPI/PUPPI data
+                if (len(shp)==3 and shp[1]==self.npoln and
+                    self.poln_order=="AABBCRCI"):
+                    warnings.warn("Polarization is " \
+                                  "AABBCRCI, summing AA and BB")
+                    data = np.zeros((self.nsamp_per_subint,
+                                     self.nchan), dtype=np.float32)
+                    data += sdata[:,0,:].squeeze()
+                    data += sdata[:,1,:].squeeze()
+                elif (len(shp)==3 and shp[1]==self.npoln and
+                    self.poln_order=="IQUV"):
+                    warnings.warn("Polarization is " \
+                                  "IQUV, just using Stokes I")
+                    data = np.zeros((self.nsamp_per_subint,
+                                     self.nchan), dtype=np.float32)
+                    data += sdata[:,0,:].squeeze()
+                else:
+                    data = np.asarray(sdata)
+            data = data.reshape((self.nsamp_per_subint, self.nchan))
+            scales, offsets, weights = self._get_coeffs(apply_weights, \
+                                                apply_scales, apply_offsets)
+            if scales is None:
+                data = data.astype(np.float32)
+            else:
+                data = np.multiply(data, scales[isub], dtype=np.float32)
+        if offsets is not None:
+            data += offsets[isub]
+        if weights is not None:
+            data *= weights[isub]
         return data
 
+    def _get_columns(self):
+        """Return the scales, offsets and weights of all subints
+            as contiguous (nsubint, nchan) float32 arrays, reading
+            them from the SUBINT table the first time. (Unlike
+            'get_scales', 'get_offsets' and 'get_weights', which
+            return the raw columns, only the first 'nchan' values
+            are kept.)
+        """
+        if self._columns is None:
+            subints = self.fits['SUBINT'].data
+            columns = []
+            for name in ('DAT_SCL', 'DAT_OFFS', 'DAT_WTS'):
+                col = np.reshape(subints[name], (len(subints), -1))
+                columns.append(np.ascontiguousarray(col[:,:self.nchan], \
+                                                    dtype=np.float32))
+            self._columns = tuple(columns)
+        return self._columns
+
+    def _get_coeffs(self, apply_weights, apply_scales, apply_offsets):
+        """Return the (scales, offsets, weights) arrays applied in
+            turn by 'read_subint'. Arrays that need not be applied
+            are None. If 'precombine' is True, the weights are folded
+            into the scales and offsets.
+        """
+        key = (apply_weights, apply_scales, apply_offsets)
+        if key not in self._coeffs:
+            allscales, alloffsets, allweights = self._get_columns()
+            scales = allscales if apply_scales else None
+            offsets = alloffsets if apply_offsets else None
+            weights = allweights if apply_weights else None
+            if self.precombine and weights is not None:
+                if scales is None:
+                    scales = weights
+                else:
+                    scales = scales*weights
+                if offsets is not None:
+                    offsets = offsets*weights
+                weights = None
+            self._coeffs[key] = (scales, offsets, weights)
+        return self._coeffs[key]
+
     def get_weights(self, isub):
         """Return weights for a particular subint.
 
@@ -169,52 +310,539 @@ class PsrfitsFile(object):
         """
         return self.fits['SUBINT'].data[isub]['DAT_OFFS']
 
-    def get_spectra(self, startsamp, N):
+    def get_spectra(self, startsamp, N, dtype='float32', nproc=1):
         """Return 2D array of data from PSRFITS file.
  
             Inputs:
                 startsamp, Starting sample
                 N: number of samples to read
+                dtype: Data type of the returned Spectra. If None,
+                    keep the type of the decoded data. (Default: float32)
+                nproc: Number of processes decoding subints in
+                    parallel. Ignored unless multiprocessing forks
+                    its workers. (Default: decode in this process)
  
             Output:
                 data: 2D numpy array
+
+            The output array is allocated once and each subint is
+            decoded straight into its place, highest frequency first.
+            Fewer than N samples are returned if the end of the file
+            is reached.
         """
-        # Calculate starting subint and ending subint
-        startsub = int(startsamp/self.nsamp_per_subint)
-        skip = startsamp - (startsub*self.nsamp_per_subint)
-        endsub = int((startsamp+N)/self.nsamp_per_subint)
-        trunc = ((endsub+1)*self.nsamp_per_subint) - (startsamp+N)
-        
-        # Read data
-        data = []
-        for isub in xrange(startsub, endsub+1):
-            data.append(self.read_subint(isub))
-        if len(data) > 1:
-            data = np.concatenate(data)
+        if nproc > 1 and uses_fork():
+            data = self._read_parallel(startsamp, N, nproc)
         else:
-            data = np.array(data).squeeze()
-	data = np.transpose(data)
-        # Truncate data to desired interval
-	if trunc > 0:
-            data = data[:, skip:-trunc]
-	elif trunc == 0:
-            data = data[:, skip:]
-        else:
-            raise ValueError("Number of bins to truncate is negative: %d" % trunc)
+            ranges = self._get_subint_ranges(startsamp, N)
+            data = np.empty((self.nchan, sum(r[2] for r in ranges)), \
+                            dtype=np.float32)
+            dest = self._flip_channels(data)
+            for isub, skip, nuse, pos in ranges:
+                transpose_into(self.read_subint(isub)[skip:skip+nuse], \
+                               dest[:,pos:pos+nuse])
+        spec = spectra.Spectra(self._flip_channels(self.freqs), self.tsamp, \
+                               data, starttime=self.tsamp*startsamp, dm=0, \
+                               dtype=dtype)
+        if spec.dtype == data.dtype:
+            spec.data = data # Already in the right order. Avoid a copy.
+        return spec
+
+    def _get_subint_ranges(self, startsamp, N):
+        """Return the parts of subints holding samples 'startsamp'
+            to 'startsamp+N', stopping at the end of the file.
+
+            Inputs:
+                startsamp: Starting sample.
+                N: Number of samples.
+
+            Output:
+                ranges: A list of (isub, skip, nuse, pos) tuples.
+                    Samples 'skip' to 'skip+nuse' of subint 'isub'
+                    are samples 'pos' to 'pos+nuse' of the range.
+        """
+        startsamp = int(startsamp)
+        stopsamp = min(startsamp+int(N), int(self.nspec))
+        ranges = []
+        isamp = startsamp
+        while isamp < stopsamp:
+            isub = isamp // self.nsamp_per_subint
+            skip = isamp - isub*self.nsamp_per_subint
+            nuse = min(self.nsamp_per_subint-skip, stopsamp-isamp)
+            ranges.append((isub, skip, nuse, isamp-startsamp))
+            isamp += nuse
+        return ranges
+
+    def _flip_channels(self, data):
+        """Return a view of 'data' (indexed by channel first) with
+            the highest frequency first, as the spectra module expects.
+        """
+        if self.specinfo.need_flipband:
+            return data
+        # for psrfits module freqs go from low to high.
+        return data[::-1]
+
+    def iter_blocks(self, block_size, overlap=0, prefetch=2, startsamp=0, \
+                    N=None, dtype='float32'):
+        """Iterate over the file in blocks of spectra, reading
+            ahead on a background thread.
+
+            Inputs:
+                block_size: Number of new samples per block.
+                overlap: Number of samples at the end of each block
+                    that are repeated at the start of the next one.
+                    (Default: 0)
+                prefetch: Number of blocks to read ahead. If 0, read
+                    blocks synchronously. (Default: 2)
+                startsamp: Starting sample. (Default: 0)
+                N: Number of samples to read. (Default: read to
+                    the end of the file)
+                dtype: Data type of each block's Spectra. If None,
+                    keep float32. (Default: float32)
+
+            Output:
+                blocks: A generator of Spectra objects.
+
+            See blockio.iter_blocks for details.
+        """
+        return blockio.iter_blocks(self, block_size, overlap=overlap, \
+                                   prefetch=prefetch, start=startsamp, nspec=N, \
+                                   dtype=dtype)
+
+    def _read_parallel(self, startsamp, N, nproc):
+        """Decode subints with a pool of worker processes.
+
+            Inputs:
+                startsamp: Starting sample.
+                N: Number of samples to read.
+                nproc: Number of worker processes.
+
+            Output:
+                data: A (nchan, nread) float32 array, highest frequency
+                    first. Fewer than N samples are returned if the
+                    end of the file is reached.
+
+            Each worker opens its own memory-mapped handle of the
+            file and writes the subints it decodes straight into a
+            shared array, so only the task descriptions are sent
+            between processes. The shared array is an anonymous
+            memory map inherited by the workers, whose pages are
+            only allocated when the workers write to them. It is
+            only shared if the workers are forked (see 'uses_fork').
+        """
+        tasks = self._get_subint_ranges(startsamp, N)
+        shape = (self.nchan, sum(task[2] for task in tasks))
+        if not tasks:
+            return np.empty(shape, dtype=np.float32)
+        buf = mmap.mmap(-1, shape[0]*shape[1]*np.dtype(np.float32).itemsize)
+        pool = multiprocessing.Pool(min(nproc, len(tasks)), \
+                        initializer=_init_decode_worker, \
+                        initargs=(self.filename, self.precombine, buf, shape))
+        try:
+            pool.map(_decode_subint, tasks, \
+                     chunksize=max(1, len(tasks)//(4*nproc)))
+        finally:
+            pool.close()
+            pool.join()
+        return np.frombuffer(buf, dtype=np.float32).reshape(shape)
+
+    def _alloc_rows(self, nspec):
+        return np.empty((nspec, self.nchan), dtype=np.float32)
+
+    def _read_rows(self, startsamp, N, out=None):
+        """Read samples into the rows of 'out'.
+
+            Inputs:
+                startsamp: Starting sample.
+                N: Number of samples to read.
+                out: Array of shape (>=N, nchan) to read the samples
+                    into. (Default: allocate a new array)
+
+            Output:
+                rows: Array of shape (nread, nchan) in file channel
+                    order. Fewer than N samples are returned if
+                    the end of the file is reached.
+        """
+        ranges = self._get_subint_ranges(startsamp, N)
+        N = sum(r[2] for r in ranges)
+        if out is None:
+            out = self._alloc_rows(N)
+        rows = out[:N]
+        for isub, skip, nuse, pos in ranges:
+            rows[pos:pos+nuse] = self.read_subint(isub)[skip:skip+nuse]
+        return rows
+
+    def _make_spectra(self, rows, startsamp, dtype='float32'):
+        return spectra.Spectra(self._flip_channels(self.freqs), self.tsamp, \
+                               self._flip_channels(rows.T), \
+                               starttime=self.tsamp*startsamp, dm=0, \
+                               dtype=dtype)
+
+    def close(self):
+        self.fits.close()
+
+
+class PsrfitsSeries(object):
+    """A set of PSRFITS files from a single observation that can be
+        read as a single stream of spectra, as PRESTO does.
+    """
+    def __init__(self, filenames, max_open=MAX_OPEN_FILES, precombine=True):
+        """PsrfitsSeries constructor.
+
+            Inputs:
+                filenames: A list of the PSRFITS files' names, in
+                    chronological order.
+                max_open: Largest number of files kept open at a time.
+                    The least recently used file is closed when
+                    another one must be opened. (Default: MAX_OPEN_FILES)
+                precombine: See PsrfitsFile. (Default: True)
+
+            Gaps between files (e.g. missing subints) are filled with
+            the mean spectrum of the last subint before the gap, using
+            the padding computed by SpectraInfo.
+        """
+        if not len(filenames):
+            raise ValueError("No PSRFITS files provided!")
+        self.filenames = list(filenames)
+        self.specinfo = SpectraInfo(self.filenames)
+        self.max_open = max(1, int(max_open))
+        self.precombine = precombine
+        self.nchan = self.specinfo.num_channels
+        self.tsamp = self.specinfo.dt
+        self.num_spec = self.specinfo.num_spec.astype('int')
+        # SpectraInfo's padding includes 0.5 to round to a whole sample
+        self.num_pad = self.specinfo.num_pad.astype('int')
+        # Global index of the first spectrum of each file. The last
+        # entry is the total number of spectra.
+        self.offsets = np.concatenate(([0], \
+                            np.cumsum(self.num_spec+self.num_pad))).astype('int')
+        self.nspec = int(self.offsets[-1])
+        self._open = collections.OrderedDict() # Open files, oldest first
+        self._padvals = {} # Padding spectrum following each file
+        # Guards the open files, which a background iter_blocks thread
+        # and the caller may use at the same time. Reentrant because
+        # reading rows opens files and computes padding values.
+        self._lock = threading.RLock()
+        self.freqs = self._get_file(0).freqs
+        self.frequencies = self.freqs # Alias
+
+    def _get_file(self, ifile):
+        """Return the PsrfitsFile object of file number 'ifile',
+            opening it (and closing the least recently used file)
+            if needed.
+        """
+        with self._lock:
+            if ifile in self._open:
+                pfits = self._open.pop(ifile)
+            else:
+                if len(self._open) >= self.max_open:
+                    self._open.popitem(last=False)[1].close()
+                pfits = PsrfitsFile(self.filenames[ifile], \
+                                    precombine=self.precombine)
+            self._open[ifile] = pfits
+            return pfits
+
+    def _get_padvals(self, ifile):
+        """Return the spectrum used to pad the gap after file
+            number 'ifile'.
+        """
+        with self._lock:
+            if ifile not in self._padvals:
+                pfits = self._get_file(ifile)
+                lastsub = pfits.read_subint(int(pfits.nsubints)-1)
+                self._padvals[ifile] = lastsub.mean(axis=0)
+            return self._padvals[ifile]
+
+    def close(self):
+        with self._lock:
+            while self._open:
+                self._open.popitem()[1].close()
+
+    def get_spectra(self, startsamp, N, dtype='float32'):
+        """Return spectra, possibly spanning several files.
+
+            Inputs:
+                startsamp: Global index of the first spectrum to read.
+                N: Number of spectra to read.
+                dtype: Data type of the returned Spectra. If None,
+                    keep float32. (Default: float32)
+
+            Output:
+                spec: A Spectra object.
+        """
+        rows = self._read_rows(startsamp, N)
+        return self._make_spectra(rows, startsamp, dtype)
+
+    def iter_blocks(self, block_size, overlap=0, prefetch=2, startsamp=0, \
+                    N=None, dtype='float32'):
+        """Iterate over all files in blocks of spectra. Blocks
+            span file boundaries and gaps. See PsrfitsFile.iter_blocks.
+        """
+        return blockio.iter_blocks(self, block_size, overlap=overlap, \
+                                   prefetch=prefetch, start=startsamp, \
+                                   nspec=N, dtype=dtype)
+
+    def _alloc_rows(self, nspec):
+        return np.empty((nspec, self.nchan), dtype=np.float32)
+
+    def _read_rows(self, startsamp, N, out=None):
+        """Read spectra, stitching them together across file
+            boundaries and padding gaps. See PsrfitsFile._read_rows.
+        """
+        startsamp = int(startsamp)
+        stopsamp = min(startsamp+int(N), self.nspec)
+        N = max(0, stopsamp-startsamp)
+        if out is None:
+            out = self._alloc_rows(N)
+        rows = out[:N]
+        isamp = startsamp
+        ifile = np.searchsorted(self.offsets, startsamp, side='right')-1
+        ifile = max(0, min(ifile, len(self.filenames)-1))
+        # Hold the lock so that no file is closed while it is read
+        with self._lock:
+            while isamp < stopsamp:
+                # Position within the file, followed by its padding
+                local = isamp-self.offsets[ifile]
+                endsamp = min(self.offsets[ifile+1], stopsamp)
+                dest = rows[isamp-startsamp:endsamp-startsamp]
+                if local < self.num_spec[ifile]:
+                    nread = min(self.num_spec[ifile]-local, endsamp-isamp)
+                    self._get_file(ifile)._read_rows(local, nread, \
+                                                     out=dest[:nread])
+                    dest = dest[nread:]
+                if len(dest):
+                    dest[:] = self._get_padvals(ifile)
+                isamp = endsamp
+                ifile += 1
+        return rows
+
+    def _make_spectra(self, rows, startsamp, dtype='float32'):
+        data = rows.T
         if not self.specinfo.need_flipband:
             # for psrfits module freqs go from low to high.
             # spectra module expects high frequency first.
             data = data[::-1,:]
             freqs = self.freqs[::-1]
         else:
-            freqs = self.freqs 
+            freqs = self.freqs
+        return spectra.Spectra(freqs, self.tsamp, data, \
+                               starttime=self.tsamp*startsamp, dm=0, \
+                               dtype=dtype)
 
-	return spectra.Spectra(freqs, self.tsamp, data, \
-                               starttime=self.tsamp*startsamp, dm=0)
+
+class PsrfitsHeaders(object):
+    """The headers of a PSRFITS file, as read by 'scan_psrfits'.
+    """
+    def __init__(self, hdu_names, primary, subint, colnames, colformats, \
+                 first_subint):
+        """PsrfitsHeaders constructor.
+
+            Inputs:
+                hdu_names: Names of the file's HDUs.
+                primary: Dictionary of the primary header's cards.
+                subint: Dictionary of the SUBINT header's cards.
+                colnames: Names of the SUBINT table's columns.
+                colformats: Formats (i.e. TFORM values) of the columns.
+                first_subint: Dictionary of the values of the
+                    SCANNED_COLUMNS in the first row of the table.
+        """
+        self.hdu_names = hdu_names
+        self.primary = primary
+        self.subint = subint
+        self.colnames = colnames
+        self.colformats = colformats
+        self.first_subint = first_subint
+
+    def is_psrfits(self):
+        """Return True if the headers are those of a PSRFITS
+            search mode file. See 'is_PSRFITS'.
+        """
+        return (self.primary.get('FITSTYPE') == "PSRFITS") and \
+                (self.primary.get('OBS_MODE') == "SEARCH")
+
+
+def parse_card_value(text):
+    """Convert the value part of a FITS header card (i.e. the
+        text following '= ') to a python object.
+    """
+    text = text.strip()
+    if text.startswith("'"):
+        # Strings end with the first single quote that is not doubled
+        value = []
+        ii = 1
+        while ii < len(text):
+            if text[ii] == "'":
+                if text[ii+1:ii+2] != "'":
+                    break
+                ii += 1
+            value.append(text[ii])
+            ii += 1
+        return ''.join(value).rstrip()
+    text = text.split('/')[0].strip()
+    if text == 'T':
+        return True
+    elif text == 'F':
+        return False
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text.replace('D', 'E'))
+    except ValueError:
+        return text
+
+
+def read_fits_header(infile):
+    """Read a FITS header starting at the current position of
+        'infile'.
+
+        Input:
+            infile: A file object open in binary mode.
+
+        Output:
+            header: A dictionary of the header's cards. Comment
+                cards are ignored.
+            hdrlen: Length (in bytes) of the header.
+    """
+    header = {}
+    hdrlen = 0
+    while True:
+        block = infile.read(FITS_BLOCK_SIZE)
+        if len(block) < FITS_BLOCK_SIZE:
+            raise ValueError("FITS header of '%s' ends without an " \
+                             "END card!" % infile.name)
+        hdrlen += FITS_BLOCK_SIZE
+        for pos in range(0, FITS_BLOCK_SIZE, FITS_CARD_SIZE):
+            card = block[pos:pos+FITS_CARD_SIZE]
+            key = card[:8].strip()
+            if key == 'END':
+                return header, hdrlen
+            if card[8:10] == '= ':
+                header[key] = parse_card_value(card[10:])
+
+
+def get_data_size(header):
+    """Return the size (in bytes) of the data following a FITS
+        header, including the padding to a whole number of blocks.
+    """
+    naxis = header.get('NAXIS', 0)
+    if naxis == 0:
+        return 0
+    nelem = 1
+    for ii in range(1, naxis+1):
+        nelem *= header['NAXIS%d' % ii]
+    nbytes = abs(header['BITPIX'])//8 * header.get('GCOUNT', 1) * \
+                (header.get('PCOUNT', 0) + nelem)
+    return -(-nbytes//FITS_BLOCK_SIZE)*FITS_BLOCK_SIZE
+
+
+def get_column_size(tform):
+    """Return the size (in bytes) of a binary table column,
+        given its format (i.e. its TFORM value).
+    """
+    m = tform_re.match(tform)
+    if m is None:
+        raise ValueError("Unrecognized column format (%s)!" % tform)
+    repeat = int(m.group('repeat') or 1)
+    if m.group('type') == 'X':
+        return -(-repeat//8)
+    size = FITS_COLUMN_TYPES[m.group('type')][0]
+    if m.group('type') in 'PQ':
+        return size
+    return repeat*size
+
+
+def scan_psrfits(filename):
+    """Read the headers of a PSRFITS file, without reading its data.
+
+        Only the header blocks of each HDU are read, and the
+        values of the SCANNED_COLUMNS of the first subint.
+        This is much faster than opening the file with pyfits.
+
+        Input:
+            filename: Name of the PSRFITS file.
+
+        Output:
+            headers: A PsrfitsHeaders object.
+    """
+    hdu_names = []
+    primary = subint = None
+    with open(filename, 'rb') as infile:
+        filesize = os.fstat(infile.fileno()).st_size
+        pos = 0
+        while pos < filesize:
+            infile.seek(pos)
+            header, hdrlen = read_fits_header(infile)
+            datapos = pos + hdrlen
+            if primary is None:
+                primary = header
+                hdu_names.append('PRIMARY')
+            else:
+                hdu_names.append(str(header.get('EXTNAME', '')).upper())
+                if hdu_names[-1] == 'SUBINT' and subint is None:
+                    subint = header
+                    subintpos = datapos
+            pos = datapos + get_data_size(header)
+        if subint is None:
+            raise ValueError("File '%s' has no SUBINT HDU!" % filename)
+
+        colnames, colformats, first_subint = [], [], {}
+        offset = 0
+        for ii in range(1, subint.get('TFIELDS', 0)+1):
+            name = str(subint.get('TTYPE%d' % ii, '')).strip()
+            tform = str(subint['TFORM%d' % ii]).strip()
+            colnames.append(name)
+            colformats.append(tform)
+            m = tform_re.match(tform)
+            if name in SCANNED_COLUMNS and subint.get('NAXIS2', 0) > 0 and \
+                    FITS_COLUMN_TYPES[m.group('type')][1] is not None:
+                # Read the column's value in the first row
+                dtype = np.dtype(FITS_COLUMN_TYPES[m.group('type')][1])
+                repeat = int(m.group('repeat') or 1)
+                infile.seek(subintpos+offset)
+                values = np.fromstring(infile.read(repeat*dtype.itemsize), \
+                                       dtype=dtype)
+                values = values.astype(dtype.newbyteorder('='))
+                if ('TSCAL%d' % ii) in subint or ('TZERO%d' % ii) in subint:
+                    values = values*subint.get('TSCAL%d' % ii, 1) + \
+                                subint.get('TZERO%d' % ii, 0)
+                if repeat == 1:
+                    values = values[0]
+                first_subint[name] = values
+            offset += get_column_size(tform)
+    return PsrfitsHeaders(hdu_names, primary, subint, colnames, colformats, \
+                          first_subint)
+
+
+def scan_headers(filenames, indexfn):
+    """Read the headers of PSRFITS files, reusing those kept in
+        an index file ('indexfn') for files whose size and
+        modification time have not changed. The index is updated.
+
+        Inputs:
+            filenames: A list of PSRFITS files' names.
+            indexfn: Name of the index file.
+
+        Output:
+            index: The headerindex.HeaderIndex object, which can
+                be passed to SpectraInfo.
+    """
+    index = headerindex.HeaderIndex(indexfn)
+    index.scan(filenames, scan_psrfits)
+    return index
 
 
 class SpectraInfo:
-    def __init__(self, filenames):
+    def __init__(self, filenames, index=None):
+        """SpectraInfo constructor.
+
+            Inputs:
+                filenames: A list of PSRFITS files' names.
+                index: A headerindex.HeaderIndex object holding
+                    headers previously read by 'scan_psrfits'. Files
+                    that are missing from it or changed are scanned
+                    and added. (Default: scan every file)
+        """
         self.filenames = filenames
         self.num_files = len(filenames)
         self.N = 0
@@ -236,16 +864,18 @@ class SpectraInfo:
         self.need_flipband = False
 
         for ii, fn in enumerate(filenames):
-            if not is_PSRFITS(fn):
+            # Read the headers of the PSRFITS file
+            if index is None:
+                headers = scan_psrfits(fn)
+            else:
+                headers = index.get(fn, scan_psrfits)
+            if not headers.is_psrfits():
                 raise ValueError("File '%s' does not appear to be PSRFITS!" % fn)
             
-            # Open the PSRFITS file
-            hdus = pyfits.open(fn, mode='readonly', memmap=True)
-            
             if ii==0:
-                self.hdu_names = [hdu.name for hdu in hdus]
+                self.hdu_names = headers.hdu_names
 
-            primary = hdus['PRIMARY'].header
+            primary = headers.primary
 
             if 'TELESCOP' not in primary.keys():
                 telescope = ""
@@ -292,7 +922,7 @@ class SpectraInfo:
                     warnings.warn("'TRK_MODE' values don't match for files 0 and %d" % ii)
 
             # Now switch to the subint HDU header
-            subint = hdus['SUBINT'].header
+            subint = headers.subint
             
             self.dt = subint['TBIN']
             self.num_channels = subint['NCHAN']
@@ -330,52 +960,52 @@ class SpectraInfo:
             self.start_spec[ii] = (MJDf * psr_utils.SECPERDAY / self.dt + 0.5)
 
             # Now pull stuff from the columns
-            subint_hdu = hdus['SUBINT']
-            first_subint = subint_hdu.data[0]
+            colnames = headers.colnames
+            first_subint = headers.first_subint
             # Identify the OFFS_SUB column number
-            if 'OFFS_SUB' not in subint_hdu.columns.names:
+            if 'OFFS_SUB' not in colnames:
                 warnings.warn("Can't find the 'OFFS_SUB' column!")
             else:
-                colnum = subint_hdu.columns.names.index('OFFS_SUB')
+                colnum = colnames.index('OFFS_SUB')
                 if ii==0:
                     self.offs_sub_col = colnum 
                 elif self.offs_sub_col != colnum:
                     warnings.warn("'OFFS_SUB' column changes between files 0 and %d!" % ii)
 
             # Identify the data column and the data type
-            if 'DATA' not in subint_hdu.columns.names:
+            if 'DATA' not in colnames:
                 warnings.warn("Can't find the 'DATA' column!")
             else:
-                colnum = subint_hdu.columns.names.index('DATA')
+                colnum = colnames.index('DATA')
                 if ii==0:
                     self.data_col = colnum
-                    self.FITS_typecode = subint_hdu.columns[self.data_col].format[-1]
+                    self.FITS_typecode = headers.colformats[self.data_col][-1]
                 elif self.data_col != colnum:
                     warnings.warn("'DATA' column changes between files 0 and %d!" % ii)
 
             # Telescope azimuth
-            if 'TEL_AZ' not in subint_hdu.columns.names:
+            if 'TEL_AZ' not in colnames:
                 self.azimuth = 0.0
             else:
-                colnum = subint_hdu.columns.names.index('TEL_AZ')
+                colnum = colnames.index('TEL_AZ')
                 if ii==0:
                     self.tel_az_col = colnum
                     self.azimuth = first_subint['TEL_AZ']
 
             # Telescope zenith angle
-            if 'TEL_ZEN' not in subint_hdu.columns.names:
+            if 'TEL_ZEN' not in colnames:
                 self.zenith_ang = 0.0
             else:
-                colnum = subint_hdu.columns.names.index('TEL_ZEN')
+                colnum = colnames.index('TEL_ZEN')
                 if ii==0:
                     self.tel_zen_col = colnum
                     self.zenith_ang = first_subint['TEL_ZEN']
 
             # Observing frequencies
-            if 'DAT_FREQ' not in subint_hdu.columns.names:
+            if 'DAT_FREQ' not in colnames:
                 warnings.warn("Can't find the channel freq column, 'DAT_FREQ'!")
             else:
-                colnum = subint_hdu.columns.names.index('DAT_FREQ')
+                colnum = colnames.index('DAT_FREQ')
                 freqs = first_subint['DAT_FREQ']
                 if ii==0:
                     self.freqs_col = colnum
@@ -398,10 +1028,10 @@ class SpectraInfo:
                         warnings.warn("High channel changes between files 0 and %d!" % ii)
 
             # Data weights
-            if 'DAT_WTS' not in subint_hdu.columns.names:
+            if 'DAT_WTS' not in colnames:
                 warnings.warn("Can't find the channel weights column, 'DAT_WTS'!")
             else:
-                colnum = subint_hdu.columns.names.index('DAT_WTS')
+                colnum = colnames.index('DAT_WTS')
                 if ii==0:
                     self.dat_wts_col = colnum
                 elif self.dat_wts_col != colnum:
@@ -410,10 +1040,10 @@ class SpectraInfo:
                     self.need_weight = True
                 
             # Data offsets
-            if 'DAT_OFFS' not in subint_hdu.columns.names:
+            if 'DAT_OFFS' not in colnames:
                 warnings.warn("Can't find the channel offsets column, 'DAT_OFFS'!")
             else:
-                colnum = subint_hdu.columns.names.index('DAT_OFFS')
+                colnum = colnames.index('DAT_OFFS')
                 if ii==0:
                     self.dat_offs_col = colnum
                 elif self.dat_offs_col != colnum:
@@ -422,10 +1052,10 @@ class SpectraInfo:
                     self.need_offset = True
 
             # Data scalings
-            if 'DAT_SCL' not in subint_hdu.columns.names:
+            if 'DAT_SCL' not in colnames:
                 warnings.warn("Can't find the channel scalings column, 'DAT_SCL'!")
             else:
-                colnum = subint_hdu.columns.names.index('DAT_SCL')
+                colnum = colnames.index('DAT_SCL')
                 if ii==0:
                     self.dat_scl_col = colnum
                 elif self.dat_scl_col != colnum:
@@ -478,6 +1108,8 @@ class SpectraInfo:
         self.BW = self.num_channels * self.df
         self.mjd = int(self.start_MJD[0])
         self.secs = (self.start_MJD[0] % 1)*psr_utils.SECPERDAY
+        if index is not None:
+            index.save()
 
     def __str__(self):
         """Format spectra_info's information into a easy to
@@ -1,9 +1,11 @@
 #!/usr/bin/env python
 import os
+import glob
 import struct
 import sys
 import math
 import warnings
+import headerindex
 from psr_constants import ARCSECTORAD
 
 telescope_ids = {"Fake": 0, "Arecibo": 1, "ARECIBO 305m": 1, 
@@ -140,20 +142,68 @@ def addto_hdr(paramname, value):
         warnings.warning("key '%s' is unknown!" % paramname)
     return hdr
 
+# Number of bytes read at once when reading a header
+HEADER_CHUNK_SIZE = 4096
+
+# struct formats and sizes of the header value types
+header_value_formats = {'d': ('d', 8), 'i': ('i', 4), 'q': ('q', 8)}
+
+def parse_header(buf):
+    """
+    parse_header(buf):
+       Decode a SIGPROC-style header held in the string 'buf' and return
+          the keys/values in a dictionary, as well as the length of the
+          header: (hdrdict, hdrlen). An EOFError is raised if 'buf' ends
+          before "HEADER_END".
+    """
+    hdrdict = {}
+    pos = 0
+    param = ""
+    try:
+        while (param != "HEADER_END"):
+            strlen = struct.unpack_from('i', buf, pos)[0]
+            param = buf[pos+4:pos+4+strlen]
+            pos += 4+strlen
+            if pos > len(buf):
+                raise struct.error("Truncated header parameter name")
+            partype = header_params[param]
+            if partype == 'str':
+                strlen = struct.unpack_from('i', buf, pos)[0]
+                val = buf[pos+4:pos+4+strlen]
+                pos += 4+strlen
+            elif partype == 'flag':
+                val = None
+            else:
+                fmt, size = header_value_formats[partype]
+                val = struct.unpack_from(fmt, buf, pos)[0]
+                pos += size
+            if pos > len(buf):
+                raise struct.error("Truncated header value")
+            hdrdict[param] = val
+    except struct.error:
+        raise EOFError("Buffer ends before HEADER_END")
+    return hdrdict, pos
+
 def read_header(infile):
     """
     read_header(infile):
        Read a SIGPROC-style header and return the keys/values in a dictionary,
           as well as the length of the header: (hdrdict, hdrlen)
+       The header is read in large chunks and decoded from memory.
     """
-    hdrdict = {}
     if type(infile) == type("abc"):
-        infile = open(infile)
-    param = ""
-    while (param != "HEADER_END"):
-        param, val = read_hdr_val(infile, stdout=False)
-        hdrdict[param] = val
-    hdrlen = infile.tell()
+        infile = open(infile, 'rb')
+    buf = infile.read(HEADER_CHUNK_SIZE)
+    while True:
+        try:
+            hdrdict, hdrlen = parse_header(buf)
+            break
+        except EOFError:
+            more = infile.read(len(buf))
+            if not more:
+                infile.close()
+                raise
+            buf += more
     infile.close()
     return hdrdict, hdrlen
 
@@ -164,13 +214,32 @@ def samples_per_file(infile, hdrdict, hdrlen):
            dictionary and length (as returned by read_header()),
            return the number of (time-domain) samples in the file.
     """
-    numbytes = os.stat(infile)[6] - hdrlen
-    bytes_per_sample = hdrdict['nchans'] * (hdrdict['nbits']/8)
-    if numbytes % bytes_per_sample:
+    numbits = (os.stat(infile)[6] - hdrlen) * 8
+    bits_per_sample = hdrdict['nchans'] * hdrdict['nbits']
+    if numbits % bits_per_sample:
         print "Warning!:  File does not appear to be of the correct length!"
-    numsamples = numbytes / bytes_per_sample
+    numsamples = numbits / bits_per_sample
     return numsamples
 
+def scan_headers(directory, pattern="*.fil", indexfn=None):
+    """
+    scan_headers(directory, pattern="*.fil", indexfn=None):
+       Read the headers of all SIGPROC-style files in 'directory' whose
+          names match 'pattern', and return a dictionary mapping each
+          file name to (hdrdict, hdrlen, numsamples). Parsed headers are
+          kept in an index file ('indexfn', by default 'sigproc_headers.idx'
+          in the user's cache directory, see headerindex.get_user_indexfn)
+          and are only read again if a file's size or modification time
+          changes. Nothing is written to 'directory'.
+    """
+    if indexfn is None:
+        indexfn = headerindex.get_user_indexfn("sigproc_headers.idx")
+    def parse(filenm):
+        hdrdict, hdrlen = read_header(filenm)
+        return hdrdict, hdrlen, samples_per_file(filenm, hdrdict, hdrlen)
+    filenms = sorted(glob.glob(os.path.join(directory, pattern)))
+    return headerindex.HeaderIndex(indexfn).scan(filenms, parse)
+
 if __name__ == "__main__":
     if len(sys.argv)==1:
         print "\nusage:  mod_filterbank_hdr.py infile.fil [outfile.fil]\n"
@@ -1,14 +1,94 @@
 import copy
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 import scipy.signal
+import scipy.ndimage
 import psr_utils
+import fdmt
+
+# Number of samples shifted at a time by Spectra.shift_channels
+SHIFT_BLOCK_SIZE = 2**16
+# Channels shorter than this are shifted with a single gather per block.
+# Longer channels are rotated with two contiguous slice copies each,
+# which beats the gather once the per-channel loop overhead is small
+# next to the copies (from about 1024 samples per channel).
+SHIFT_GATHER_MAX_LEN = 1024
+# Number of output samples gathered at a time by Spectra.dedisperse_trials
+TRIALS_BLOCK_SIZE = 2**16
+# Number of samples processed at a time when removing baselines
+BASELINE_BLOCK_SIZE = 2**20
+# Number of chunk medians per window in Spectra.remove_baseline
+BASELINE_NCHUNKS = 8
+
+def get_sum_dtype(dtype):
+    """Return the dtype used to sum samples of type 'dtype'.
+        Floats keep their precision, while integers are summed
+        as floats that are wide enough to never overflow (e.g.
+        float32 for 8-bit samples).
+    """
+    return np.promote_types(dtype, np.float32)
+
+
+def boxcar_filterbank(series, widths):
+    """Search time series for pulses by convolving them with boxcars
+        of several widths. All widths are computed from a single
+        cumulative sum, so each costs O(N) operations.
+
+        Inputs:
+            series: A time series, or an array of time series along
+                its last axis (e.g. the output of
+                Spectra.dedisperse_trials).
+            widths: A list of boxcar widths (in samples).
+
+        Outputs:
+            snrs: Peak S/N for each width. The shape is
+                (len(widths),) + series.shape[:-1].
+            positions: Index of the first sample of the boxcar
+                with the peak S/N, with the same shape as 'snrs'.
+
+        The S/N of a boxcar of width 'w' is
+        (sum - w*median)/(std*sqrt(w)), where the median and standard
+        deviation are those of each series.
+    """
+    series = np.asarray(series)
+    widths = np.atleast_1d(np.asarray(widths, dtype='int'))
+    nsamp = series.shape[-1]
+    if np.any(widths < 1) or np.any(widths > nsamp):
+        raise ValueError("Boxcar widths must be between 1 and the " \
+                         "number of samples (%d)!" % nsamp)
+    leadshape = series.shape[:-1]
+    medians = np.median(series, axis=-1)[...,np.newaxis]
+    stds = series.std(axis=-1)[...,np.newaxis]
+    stds[stds == 0] = 1
+    # Cumulative sum with a leading 0, in double precision
+    cumsum = np.zeros(leadshape+(nsamp+1,), dtype='float64')
+    np.cumsum(series, axis=-1, out=cumsum[...,1:])
+    boxsums = np.empty(leadshape+(nsamp,), dtype='float64')
+
+    snrs = np.empty((len(widths),)+leadshape)
+    positions = np.empty((len(widths),)+leadshape, dtype='int')
+    for ii, width in enumerate(widths):
+        nbox = nsamp-width+1
+        sums = boxsums[...,:nbox]
+        np.subtract(cumsum[...,width:], cumsum[...,:nbox], out=sums)
+        positions[ii] = np.argmax(sums, axis=-1)
+        peaks = np.take_along_axis(sums, positions[ii][...,np.newaxis], \
+                                   axis=-1)
+        snrs[ii] = ((peaks-width*medians)/(stds*np.sqrt(width)))[...,0]
+    return snrs, positions
+
 
 class Spectra(object):
     """A class to store spectra. This is mainly to provide
         reusable functionality.
     """
-    def __init__(self, freqs, dt, data, starttime=0, dm=0):
+    # Threads used by per-channel operations. See 'set_executor'.
+    nthreads = 1
+    _pool = None
+
+    def __init__(self, freqs, dt, data, starttime=0, dm=0, dtype='float32'):
         """Spectra constructor.
             
             Inputs:
@@ -21,6 +101,18 @@ class Spectra(object):
                         with respect to the start of the observation.
                         (Default: 0).
                 dm: Dispersion measure (in pc/cm^3). (Default: 0)
+                dtype: The numpy dtype used to store the data and to
+                        perform all operations in. If None, keep the
+                        dtype of 'data' (e.g. native integer samples).
+                        (Default: float32)
+
+                        Native integer samples are kept by operations
+                        that only move or replace samples (shift_channels,
+                        dedisperse, masked and trim). Operations that sum
+                        samples (subband, downsample, smooth) or scale
+                        them (scaled, scaled2) convert the data to floats
+                        (see 'get_sum_dtype'). remove_baseline and zerodm
+                        require floating-point data.
 
             Output:
                 spectra_obj: Spectrum object.
@@ -29,20 +121,100 @@ class Spectra(object):
         assert len(freqs)==self.numchans
 
         self.freqs = freqs
-        self.data = data.astype('float')
+        if dtype is None:
+            self.dtype = data.dtype
+        else:
+            self.dtype = np.dtype(dtype)
+        # Keep a reference to the input array (e.g. a view of a
+        # memory-mapped file). It is only copied to 'self.dtype'
+        # the first time 'self.data' is accessed.
+        self._rawdata = data
+        self._data = None
         self.dt = dt
         self.starttime = starttime
         self.dm = 0
 
+    @property
+    def data(self):
+        if self._data is None:
+            # Store channels contiguously
+            self._data = np.array(self._rawdata, dtype=self.dtype, order='C')
+            self._rawdata = None
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self._rawdata = None
+
     def __str__(self):
         return str(self.data)
 
     def __getitem__(self, key):
+        if self._data is None:
+            # Only convert the requested elements
+            return np.asarray(self._rawdata[key], dtype=self.dtype)
         return self.data[key]
     
     def __setitem__(self, key, value):
         self.data[key] = value
     
+    @classmethod
+    def set_executor(cls, nthreads=1):
+        """Set the number of threads used by per-channel operations
+            (shift_channels, dedisperse, subband, scaled, scaled2,
+            masked, smooth and dedisperse_trials). Channels (or DM
+            trials) are split into contiguous slabs, each processed
+            on its own thread and written in place into disjoint rows
+            of the data.
+
+            Input:
+                nthreads: Number of threads. If 1, channels are
+                    processed on the calling thread. (Default: 1)
+
+            Output:
+                None
+        """
+        if cls._pool is not None:
+            cls._pool.close()
+            cls._pool.join()
+            cls._pool = None
+        cls.nthreads = max(1, int(nthreads))
+        if cls.nthreads > 1:
+            cls._pool = ThreadPool(cls.nthreads)
+
+    def _map_slabs(self, func, nchans=None, nthreads=None):
+        """Call func(lo, hi) for contiguous slabs of channels
+            that cover channels 0 to 'nchans' (Default: all
+            channels), on the executor's threads if it is set.
+            Other rows (e.g. DM trials) can be split the same way
+            by giving their number as 'nchans'. If 'nthreads' is
+            given, a pool of that many threads is used for this
+            call instead of the executor.
+        """
+        if nchans is None:
+            nchans = self.numchans
+        if nthreads is None:
+            pool = self._pool
+            nslabs = min(self.nthreads, nchans)
+        else:
+            pool = None
+            nslabs = min(int(nthreads), nchans)
+        if nslabs < 2 or (pool is None and nthreads is None):
+            func(0, nchans)
+            return
+        edges = np.linspace(0, nchans, nslabs+1).astype('int')
+        slabs = list(zip(edges[:-1], edges[1:]))
+        if pool is not None:
+            pool.map(lambda slab: func(*slab), slabs)
+            return
+        pool = ThreadPool(nslabs)
+        try:
+            pool.map(lambda slab: func(*slab), slabs)
+        finally:
+            pool.close()
+            pool.join()
+
     def get_chan(self, channum):
         return self.data[channum,:]
 
@@ -71,27 +243,61 @@ class Spectra(object):
             *** Shifting happens in-place ***
         """
         assert self.numchans == len(bins)
-        for ii in range(self.numchans):
-            chan = self.get_chan(ii)
-            # Use 'chan[:]' so update happens in-place
-            # this way the change effects self.data
-            chan[:] = psr_utils.rotate(chan, bins[ii])
-            if padval!='rotate':
-                # Get padding value
-                if padval=='mean':
-                    pad = np.mean(chan)
-                elif padval=='median':
-                    pad = np.median(chan)
+        nspec = self.numspectra
+        if nspec == 0:
+            return
+        data = self.data
+        bins = np.asarray(bins, dtype=np.intp)
+        rot = bins % nspec
+        isamp = np.arange(nspec, dtype=np.intp)
+        # Work on blocks of channels so that temporary arrays stay small
+        blockchans = max(1, SHIFT_BLOCK_SIZE//nspec)
+        def shift_slab(slablo, slabhi):
+            for lo in range(slablo, slabhi, blockchans):
+                hi = min(lo+blockchans, slabhi)
+                gather = nspec < SHIFT_GATHER_MAX_LEN
+                if gather:
+                    # Gather all channels of the block at once using the
+                    # flat index of the sample ending up at each position
+                    srcidx = isamp + (rot[lo:hi] + \
+                                np.arange(lo, hi)*nspec)[:,np.newaxis]
+                    wrapped = isamp >= (nspec-rot[lo:hi])[:,np.newaxis]
+                    np.subtract(srcidx, nspec, out=srcidx, where=wrapped)
+                    shifted = data.take(srcidx)
                 else:
-                    pad = padval
+                    # Copying long contiguous slices is faster
+                    # than a gather
+                    shifted = np.empty_like(data[lo:hi])
+                    for ii in range(lo, hi):
+                        shifted[ii-lo,:nspec-rot[ii]] = data[ii,rot[ii]:]
+                        shifted[ii-lo,nspec-rot[ii]:] = data[ii,:rot[ii]]
+                if padval!='rotate':
+                    # Get padding values
+                    if padval=='mean':
+                        pad = np.mean(shifted, axis=1)
+                    elif padval=='median':
+                        pad = np.median(shifted, axis=1)
+                    else:
+                        pad = np.empty(hi-lo)
+                        pad[:] = padval
                 
-                # Replace rotated values with padval
-                if bins[ii]>0:
-                    chan[-bins[ii]:] = pad
-                elif bins[ii]<0:
-                    chan[:-bins[ii]] = pad
-
-    def subband(self, nsub, subdm=None, padval=0):
+                    # Replace rotated values with padval
+                    if gather:
+                        invalid = \
+                            (isamp >= (nspec-bins[lo:hi])[:,np.newaxis]) | \
+                            (isamp < -bins[lo:hi,np.newaxis])
+                        shifted[invalid] = np.repeat(pad, invalid.sum(axis=1))
+                    else:
+                        for ii in range(lo, hi):
+                            if bins[ii]>0:
+                                shifted[ii-lo,-bins[ii]:] = pad[ii-lo]
+                            elif bins[ii]<0:
+                                shifted[ii-lo,:-bins[ii]] = pad[ii-lo]
+                # Use 'data[lo:hi]' so update happens in-place
+                data[lo:hi] = shifted
+        self._map_slabs(shift_slab)
+
+    def subband(self, nsub, subdm=None, padval=0, remainder='error'):
         """Reduce the number of channels to 'nsub' by subbanding.
             The channels within a subband are combined using the
             DM 'subdm'. 'padval' is passed to the call to
@@ -99,42 +305,74 @@ class Spectra(object):
 
             Inputs:
                 nsub: Number of subbands. Must be a factor of 
-                    the number of channels.
+                    the number of channels, unless 'remainder'
+                    is 'uneven'.
                 subdm: The DM with which to combine channels within
                     each subband (Default: don't shift channels 
                     within each subband)
                 padval: The padding value to use when shifting
                     channels during dedispersion. See documentation
                     of Spectra.shift_channels. (Default: 0)
+                remainder: What to do if the number of channels is
+                    not a multiple of 'nsub'. Either 'error' (raise
+                    a ValueError), or 'uneven' (the numbers of
+                    channels in subbands differ by at most one).
+                    (Default: 'error')
 
             Outputs:
                 None
 
             *** Subbanding happens in-place ***
         """
-        assert (self.numchans % nsub) == 0
         assert (subdm is None) or (subdm >= 0)
-        nchan_per_sub = self.numchans/nsub
-        sub_hifreqs = self.freqs[np.arange(nsub)*nchan_per_sub]
-        sub_lofreqs = self.freqs[(1+np.arange(nsub))*nchan_per_sub-1]
+        if remainder not in ('error', 'uneven'):
+            raise ValueError("Unrecognized remainder policy (%s)!" % \
+                             remainder)
+        even = (self.numchans % nsub) == 0
+        if not even and remainder == 'error':
+            raise ValueError("Number of subbands (%d) is not a factor of " \
+                             "the number of channels (%d)!" % \
+                             (nsub, self.numchans))
+        # First channel of each subband and number of channels in each
+        sub_starts = np.arange(nsub)*self.numchans//nsub
+        sub_nchans = np.diff(np.append(sub_starts, self.numchans))
+        sub_hifreqs = self.freqs[sub_starts]
+        sub_lofreqs = self.freqs[sub_starts+sub_nchans-1]
         sub_ctrfreqs = 0.5*(sub_hifreqs+sub_lofreqs)
         
         if subdm is not None:
             # Compute delays
             ref_delays = psr_utils.delay_from_DM(subdm-self.dm, sub_ctrfreqs)
             delays = psr_utils.delay_from_DM(subdm-self.dm, self.freqs)
-            rel_delays = delays-ref_delays.repeat(nchan_per_sub) # Relative delay
+            rel_delays = delays-ref_delays.repeat(sub_nchans) # Relative delay
             rel_bindelays = np.round(rel_delays/self.dt).astype('int')
             # Shift channels
             self.shift_channels(rel_bindelays, padval)
 
         # Subband
-        self.data = np.array([np.sum(sub, axis=0) for sub in \
-                                np.vsplit(self.data, nsub)])
+        data = self.data
+        sumdtype = get_sum_dtype(data.dtype)
+        if isinstance(data, np.ma.MaskedArray):
+            if even:
+                subbanded = data.reshape(nsub, -1, self.numspectra).\
+                                sum(axis=1, dtype=sumdtype)
+            else:
+                subbanded = np.ma.vstack([data[lo:lo+nchan].\
+                                sum(axis=0, dtype=sumdtype) \
+                                for lo, nchan in zip(sub_starts, sub_nchans)])
+        elif even:
+            subbanded = np.empty((nsub, self.numspectra), dtype=sumdtype)
+            np.sum(data.reshape(nsub, -1, self.numspectra), axis=1, \
+                   out=subbanded)
+        else:
+            subbanded = np.add.reduceat(data, sub_starts, axis=0, \
+                                        dtype=sumdtype)
+        self.data = subbanded
+        self.dtype = subbanded.dtype
         self.freqs = sub_ctrfreqs
         self.numchans = nsub
 
-    def scaled(self, indep=False):
+    def scaled(self, indep=False, inplace=False):
         """Return a scaled version of the Spectra object.
             When scaling subtract the median from each channel,
             and divide by global std deviation (if indep==False), or
@@ -143,23 +381,31 @@ class Spectra(object):
             Input:
                 indep: Boolean. If True, scale each row
                     independantly (Default: False).
+                inplace: Boolean. If True, scale the data of this
+                    object and return it. Otherwise, the returned
+                    object shares everything but the data with this
+                    one. (Default: False)
 
             Output:
                 scaled_spectra: A scaled version of the
-                    Spectra object.
+                    Spectra object. Integer data are converted to
+                    float32.
         """
-        other = copy.deepcopy(self)
-        if not indep:
-            std = other.data.std()
-        for ii in range(other.numchans):
-            chan = other.get_chan(ii)
-            median = np.median(chan)
+        data = self.data
+        statdtype = data.dtype if data.dtype.kind == 'f' else 'float64'
+        medians = np.empty((self.numchans, 1), dtype=statdtype)
+        if indep:
+            std = np.empty((self.numchans, 1), dtype=statdtype)
+        else:
+            std = data.std()
+        def get_stats(lo, hi):
+            medians[lo:hi,0] = np.median(data[lo:hi], axis=1)
             if indep:
-                std = chan.std()
-            chan[:] = (chan-median)/std
-        return other
+                std[lo:hi,0] = data[lo:hi].std(axis=1)
+        self._map_slabs(get_stats)
+        return self._apply_scaling(medians, std, inplace)
     
-    def scaled2(self, indep=False):
+    def scaled2(self, indep=False, inplace=False):
         """Return a scaled version of the Spectra object.
             When scaling subtract the min from each channel,
             and divide by global max (if indep==False), or
@@ -168,29 +414,73 @@ class Spectra(object):
             Input:
                 indep: Boolean. If True, scale each row
                     independantly (Default: False).
+                inplace: Boolean. If True, scale the data of this
+                    object and return it. Otherwise, the returned
+                    object shares everything but the data with this
+                    one. (Default: False)
 
             Output:
                 scaled_spectra: A scaled version of the
-                    Spectra object.
+                    Spectra object. Integer data are converted to
+                    float32.
         """
-        other = copy.deepcopy(self)
-        if not indep:
-            max = other.data.max()
-        for ii in range(other.numchans):
-            chan = other.get_chan(ii)
-            min = chan.min()
+        data = self.data
+        min = np.empty((self.numchans, 1), dtype=data.dtype)
+        if indep:
+            max = np.empty((self.numchans, 1), dtype=data.dtype)
+        else:
+            max = data.max()
+        def get_stats(lo, hi):
+            min[lo:hi,0] = data[lo:hi].min(axis=1)
             if indep:
-                max = chan.max()
-            chan[:] = (chan-min)/max
+                max[lo:hi,0] = data[lo:hi].max(axis=1)
+        self._map_slabs(get_stats)
+        return self._apply_scaling(min, max, inplace)
+
+    def _apply_scaling(self, offsets, scales, inplace):
+        """Return a Spectra object whose data are
+            (data-offsets)/scales. See 'Spectra.scaled'.
+        """
+        data = self.data
+        if inplace:
+            other = self
+        else:
+            # Shallow copy: frequencies and metadata are shared
+            other = copy.copy(self)
+        # Scaled data are always floating-point, even if the
+        # native integer samples were kept (i.e. dtype=None)
+        other.dtype = np.result_type(self.dtype, np.float32)
+        if not isinstance(data, np.ma.MaskedArray):
+            if inplace and data.dtype == other.dtype:
+                scaleddata = data
+            else:
+                scaleddata = np.empty(data.shape, dtype=other.dtype)
+            def scale_slab(lo, hi):
+                np.subtract(data[lo:hi], offsets[lo:hi], \
+                            out=scaleddata[lo:hi], casting='unsafe')
+                if np.ndim(scales):
+                    scaleddata[lo:hi] /= scales[lo:hi]
+                else:
+                    scaleddata[lo:hi] /= scales
+            self._map_slabs(scale_slab)
+            other.data = scaleddata
+        else:
+            scaleddata = np.ma.asarray(data, dtype=other.dtype) - offsets
+            scaleddata /= scales
+            other.data = scaleddata.astype(other.dtype, copy=False)
         return other
 
-    def masked(self, mask, maskval='median-mid80'):
+    def masked(self, mask, maskval='median-mid80', startsamp=None):
         """Replace masked data with 'maskval'. Returns
-            a masked copy of the Spectra object.
+            the masked Spectra object.
             
             Inputs:
-                mask: An array of boolean values of the same size and shape
-                    as self.data. True represents an entry to be masked.
+                mask: Either an array of boolean values of the same size
+                    and shape as self.data, where True represents an entry
+                    to be masked, or an rfifind.rfifind object (or any
+                    object with 'ptsperint' and 'mask_zap_chans_per_int'
+                    attributes), whose per-interval channel masks are
+                    applied directly.
                 maskval: Value to use when masking. This can be a numeric
                     value, 'median', 'mean', or 'median-mid80'.
 
@@ -199,28 +489,80 @@ class Spectra(object):
                     refers to the median of the channel after the top and bottom
                     10% of the sorted channel is removed.
                     (Default: 'median-mid80')
+                startsamp: Index of the first spectrum in the time series
+                    of an rfifind mask. Only used if 'mask' is an rfifind
+                    object. (Default: starttime/dt)
 
             Output:
                 maskedspec: A masked version of the Spectra object.
+
+            *** Masking happens in place ***
         """
-        assert self.data.shape == mask.shape
-        maskvals = np.ones(self.numchans)
-        for ii in range(self.numchans):
-            chan = self.get_chan(ii)
-            # Use 'chan[:]' so update happens in-place
+        data = self.data
+        if hasattr(mask, 'mask_zap_chans_per_int'):
+            if startsamp is None:
+                startsamp = int(np.round(self.starttime/self.dt))
+            chans_per_block = self._get_rfifind_blocks(mask, startsamp)
+            maskedchans = np.unique(np.concatenate([[]] + \
+                        [chans for lo, hi, chans in chans_per_block])).astype('int')
+        else:
+            assert data.shape == mask.shape
+            maskedchans = np.flatnonzero(mask.any(axis=1))
+        if not len(maskedchans):
+            return self
+
+        # Only compute replacement values for channels with masked data
+        chanvals = np.zeros(self.numchans)
+        def get_maskvals(lo, hi):
+            chans = maskedchans[lo:hi]
             if maskval=='mean':
-                maskvals[ii]=np.mean(chan)
-            elif maskval=='median':
-                maskvals[ii]=np.median(chan)
-            elif maskval=='median-mid80':
-                n = int(np.round(0.1*self.numspectra))
-                maskvals[ii]=np.median(sorted(chan)[n:-n])
+                chanvals[chans] = np.mean(data[chans], axis=1)
+            elif maskval in ('median', 'median-mid80'):
+                # Removing the same number of values from both ends of
+                # the sorted channel leaves its median unchanged, so
+                # both methods use a single partition-based median
+                chanvals[chans] = np.median(data[chans], axis=1)
             else:
-                maskvals[ii]=maskval
-            if np.all(mask[ii]):
-                self.data[ii] = np.ones_like(self.data[ii])*(maskvals[:,np.newaxis][ii])
+                chanvals[chans] = maskval
+            if not hasattr(mask, 'mask_zap_chans_per_int'):
+                data[chans] = np.where(mask[chans], \
+                                       chanvals[chans][:,np.newaxis], \
+                                       data[chans])
+        self._map_slabs(get_maskvals, len(maskedchans))
+
+        if hasattr(mask, 'mask_zap_chans_per_int'):
+            def apply_mask(chanlo, chanhi):
+                for lo, hi, chans in chans_per_block:
+                    chans = chans[(chans >= chanlo) & (chans < chanhi)]
+                    data[chans,lo:hi] = chanvals[chans][:,np.newaxis]
+            self._map_slabs(apply_mask)
         return self
 
+    def _get_rfifind_blocks(self, rfimask, startsamp):
+        """Return a list of (lo, hi, chans) tuples, one per rfifind
+            interval overlapping the data. Spectra lo to hi (exclusive)
+            of the data have the channels 'chans' masked. Channel
+            indices are converted to the order of 'self.freqs'
+            (rfifind channels go from low to high frequency).
+        """
+        flip = self.numchans > 1 and self.freqs[0] > self.freqs[-1]
+        blocks = []
+        if self.numspectra == 0:
+            return blocks
+        firstint = startsamp//rfimask.ptsperint
+        lastint = (startsamp+self.numspectra-1)//rfimask.ptsperint
+        for iint in range(firstint, lastint+1):
+            chans = np.asarray(rfimask.mask_zap_chans_per_int[iint], \
+                               dtype='int')
+            if not chans.size:
+                continue
+            if flip:
+                chans = self.numchans-1-chans
+            lo = max(0, iint*rfimask.ptsperint-startsamp)
+            hi = min(self.numspectra, (iint+1)*rfimask.ptsperint-startsamp)
+            blocks.append((lo, hi, chans))
+        return blocks
+
     def dedisperse(self, dm=0, padval=0):
         """Shift channels according to the delays predicted by
             the given DM.
@@ -246,6 +588,126 @@ class Spectra(object):
 
         self.dm=dm
 
+    def dedisperse_trials(self, dms, out=None, nthreads=None):
+        """Dedisperse at each of several DMs and sum the channels.
+            The data are not modified.
+
+            Inputs:
+                dms: An array of DMs (in pc/cm^3) to use.
+                out: Array of shape (len(dms), numspectra) to store
+                    the time series in. (Default: allocate a new
+                    float32 array)
+                nthreads: Number of threads, each handling a
+                    different slab of DMs. (Default: use the
+                    executor, see 'set_executor')
+
+            Output:
+                trials: Array of shape (len(dms), numspectra). Row
+                    'ii' is the sum over channels after dedispersing
+                    at dms[ii] with a padding value of 0 (i.e. as if
+                    'Spectra.dedisperse(dms[ii])' had been called on
+                    a copy of the data).
+
+            Each channel is added to the time series of all DMs of
+            a slab before moving to the next channel. The channel is
+            zero-padded and its shifted copies for a block of DMs are
+            gathered at once as rows of a strided view of it. Channels
+            longer than TRIALS_BLOCK_SIZE/2 samples are added one DM
+            at a time, since the gather is then slower than adding
+            slices.
+        """
+        dms = np.atleast_1d(np.asarray(dms, dtype='float'))
+        assert np.all(dms >= 0)
+        shape = (len(dms), self.numspectra)
+        if out is None:
+            out = np.zeros(shape, dtype='float32')
+        else:
+            assert out.shape == shape
+            out[:] = 0
+        # Delay table shared by all DMs: one row per DM
+        reldms = (dms-self.dm)[:,np.newaxis]
+        ref_delays = psr_utils.delay_from_DM(reldms, np.max(self.freqs))
+        delays = psr_utils.delay_from_DM(reldms, self.freqs)
+        rel_bindelays = np.round((delays-ref_delays)/self.dt).astype('int')
+
+        data = self.data
+        nspec = self.numspectra
+        if nspec == 0 or len(dms) == 0:
+            return out
+        # Number of DMs whose shifted channels are gathered at once.
+        # The gathered rows are kept small enough to stay cached.
+        dmstep = TRIALS_BLOCK_SIZE//nspec
+        def dedisperse_slab(lo, hi):
+            for ii in range(self.numchans):
+                # Delays beyond the data only shift in padding
+                chandelays = np.clip(rel_bindelays[lo:hi,ii], -nspec, nspec)
+                if dmstep < 2:
+                    # Long channels: adding slices needs no gather
+                    for idm, delay in zip(range(lo, hi), chandelays):
+                        if delay >= 0:
+                            out[idm,:nspec-delay] += data[ii,delay:]
+                        else:
+                            out[idm,-delay:] += data[ii,:nspec+delay]
+                    continue
+                dmin, dmax = chandelays.min(), chandelays.max()
+                # padded[jj] is sample jj+dmin of the channel, or 0
+                padded = np.zeros(nspec+dmax-dmin, dtype=out.dtype)
+                first, last = max(dmin, 0), min(nspec+dmax, nspec)
+                padded[first-dmin:last-dmin] = data[ii,first:last]
+                # Row 'kk' is the channel shifted left by kk+dmin bins
+                shifted = as_strided(padded, shape=(dmax-dmin+1, nspec), \
+                                     strides=padded.strides*2)
+                rows = chandelays-dmin
+                for dmlo in range(lo, hi, dmstep):
+                    dmhi = min(dmlo+dmstep, hi)
+                    out[dmlo:dmhi] += shifted[rows[dmlo-lo:dmhi-lo]]
+        self._map_slabs(dedisperse_slab, len(dms), nthreads=nthreads)
+        return out
+
+    def dedisperse_fdmt(self, max_dm):
+        """Dedisperse at all DMs up to 'max_dm' using the Fast
+            Dispersion Measure Transform and sum the channels.
+            The data are not modified.
+
+            Input:
+                max_dm: The largest DM (in pc/cm^3) to use.
+
+            Outputs:
+                dms: The DM of each dedispersed time series. They are
+                    spaced such that the delay across the band
+                    increases by one sample between trials.
+                trials: A (len(dms), numspectra) float32 array.
+                    Row 'ii' approximates the sum over channels after
+                    'Spectra.dedisperse(dms[ii])' (padval=0).
+        """
+        assert max_dm >= self.dm
+        fmin, fmax = np.min(self.freqs), np.max(self.freqs)
+        # Delay (in seconds) across the band for a DM of 1 pc/cm^3
+        unit_delay = psr_utils.delay_from_DM(1.0, fmin) - \
+                        psr_utils.delay_from_DM(1.0, fmax)
+        maxdelay = int(np.ceil((max_dm-self.dm)*unit_delay/self.dt))
+        trials = fdmt.fdmt(self.data, self.freqs, maxdelay)
+        if unit_delay > 0:
+            dms = self.dm + np.arange(maxdelay+1)*self.dt/unit_delay
+        else:
+            dms = np.array([self.dm])
+        return dms, trials
+
+    def boxcar_filterbank(self, widths):
+        """Sum the channels and search the resulting time series
+            for pulses with boxcars of several widths. See the
+            module function 'boxcar_filterbank'.
+
+            Input:
+                widths: A list of boxcar widths (in samples).
+
+            Outputs:
+                snrs: Peak S/N for each width.
+                positions: Index of the first spectrum of the
+                    boxcar with the peak S/N for each width.
+        """
+        return boxcar_filterbank(self.data.sum(axis=0), widths)
+
     def smooth(self, width=1, padval=0):
         """Smooth each channel by convolving with a top hat
             of given width. The height of the top had is
@@ -267,27 +729,141 @@ class Spectra(object):
             *** Smoothing is done in place. ***
         """
         if width > 1:
-            kernel = np.ones(width, dtype='float32')/np.sqrt(width)
-            for ii in range(self.numchans):
-                chan = self.get_chan(ii)
-                if padval=='wrap':
-                    tosmooth = np.concatenate([chan[-width:], \
-                                chan, chan[:width]])
-                elif padval=='mean':
-                    tosmooth = np.ones(self.numspectra+width*2) * \
-                                np.mean(chan)
-                    tosmooth[width:-width] = chan
-                elif padval=='median':
-                    tosmooth = np.ones(self.numspectra+width*2) * \
-                                np.median(chan)
-                    tosmooth[width:-width] = chan
-                else: # padval is a float
-                    tosmooth = np.ones(self.numspectra+width*2) * \
-                                padval
-                    tosmooth[width:-width] = chan
+            sumdtype = get_sum_dtype(self.data.dtype)
+            if self.data.dtype != sumdtype:
+                # Smoothed integer samples are not integers
+                self.data = self.data.astype(sumdtype)
+                self.dtype = self.data.dtype
+            kernel = np.ones(width, dtype=self.data.dtype)/np.sqrt(width)
+            def smooth_slab(lo, hi):
+                for ii in range(lo, hi):
+                    chan = self.get_chan(ii)
+                    if padval=='wrap':
+                        tosmooth = np.concatenate([chan[-width:], \
+                                    chan, chan[:width]])
+                    elif padval=='mean':
+                        tosmooth = np.empty(self.numspectra+width*2, \
+                                    dtype=chan.dtype)
+                        tosmooth[:] = np.mean(chan)
+                        tosmooth[width:-width] = chan
+                    elif padval=='median':
+                        tosmooth = np.empty(self.numspectra+width*2, \
+                                    dtype=chan.dtype)
+                        tosmooth[:] = np.median(chan)
+                        tosmooth[width:-width] = chan
+                    else: # padval is a float
+                        tosmooth = np.empty(self.numspectra+width*2, \
+                                    dtype=chan.dtype)
+                        tosmooth[:] = padval
+                        tosmooth[width:-width] = chan
                     
-                smoothed = scipy.signal.convolve(tosmooth, kernel, 'same')
-                chan[:] = smoothed[width:-width]
+                    smoothed = scipy.signal.convolve(tosmooth, kernel, 'same')
+                    chan[:] = smoothed[width:-width]
+            self._map_slabs(smooth_slab)
+
+    def remove_baseline(self, window, method='median'):
+        """Remove a time-varying baseline from each channel by
+            subtracting its running median or mean.
+
+            Inputs:
+                window: Width (in bins) of the running window.
+                method: Either 'median' or 'mean'. (Default: 'median')
+
+                    The running mean is exact, with the window
+                    truncated near the ends of the channel. The running
+                    median is approximated by the running median of the
+                    medians of chunks of window/BASELINE_NCHUNKS bins,
+                    linearly interpolated back to every bin.
+
+            Outputs:
+                None
+
+            Channels are processed a few at a time, so no temporary
+            array the size of the data is needed. Masked values are
+            included when computing the baseline.
+
+            *** Baseline removal happens in place ***
+        """
+        window = int(window)
+        if window < 1:
+            raise ValueError("Baseline window must be at least 1 bin " \
+                             "(window=%d)!" % window)
+        if method not in ('median', 'mean'):
+            raise ValueError("Unrecognized baseline method (%s)!" % method)
+        nspec = self.numspectra
+        if nspec == 0:
+            return
+        data = np.ma.getdata(self.data)
+        if data.dtype.kind != 'f':
+            raise ValueError("Baseline removal requires floating-point " \
+                             "data (dtype=%s)!" % data.dtype)
+        isamp = np.arange(nspec)
+        blockchans = max(1, BASELINE_BLOCK_SIZE//nspec)
+        if method == 'mean':
+            starts = np.maximum(isamp-window//2, 0)
+            ends = np.minimum(starts+window, nspec)
+            counts = ends-starts
+        else:
+            step = max(1, window//BASELINE_NCHUNKS)
+            nfull = nspec//step
+            nchunk = nfull + (nspec > nfull*step)
+            centres = np.arange(nchunk)*step + 0.5*(step-1)
+            if nchunk > nfull:
+                centres[-1] = nfull*step + 0.5*(nspec-nfull*step-1)
+            # Use an odd number of chunks so the window is centred
+            ncoarse = int(np.round(float(window)/step))
+            ncoarse += 1 - ncoarse % 2
+
+        def remove_slab(slablo, slabhi):
+            for lo in range(slablo, slabhi, blockchans):
+                hi = min(slabhi, lo+blockchans)
+                rows = data[lo:hi]
+                if method == 'mean':
+                    csum = np.zeros((hi-lo, nspec+1))
+                    np.cumsum(rows, axis=1, out=csum[:,1:])
+                    baseline = csum[:,ends]
+                    baseline -= csum[:,starts]
+                    baseline /= counts
+                    rows -= baseline
+                else:
+                    coarse = np.empty((hi-lo, nchunk))
+                    coarse[:,:nfull] = np.median(rows[:,:nfull*step].\
+                                reshape(hi-lo, nfull, step), axis=2)
+                    if nchunk > nfull:
+                        coarse[:,nfull] = np.median(rows[:,nfull*step:], \
+                                                    axis=1)
+                    coarse = scipy.ndimage.median_filter(coarse, \
+                                    size=(1, ncoarse), mode='nearest')
+                    for ii in range(hi-lo):
+                        rows[ii] -= np.interp(isamp, centres, coarse[ii])
+        self._map_slabs(remove_slab)
+
+    def zerodm(self):
+        """Subtract the mean of each spectrum (i.e. the zero-DM
+            time series) from every channel.
+
+            Inputs:
+                None
+
+            Outputs:
+                None
+
+            Spectra are processed in blocks, so no temporary array
+            the size of the data is needed. Since every spectrum is
+            independent, applying this to each block yielded by
+            blockio.iter_blocks gives the same result as applying it
+            to the whole observation.
+
+            *** Subtraction happens in place ***
+        """
+        data = self.data
+        if data.dtype.kind != 'f':
+            raise ValueError("Zero-DM filtering requires floating-point " \
+                             "data (dtype=%s)!" % data.dtype)
+        blocksamps = max(1, BASELINE_BLOCK_SIZE//max(1, self.numchans))
+        for lo in range(0, self.numspectra, blocksamps):
+            hi = min(self.numspectra, lo+blocksamps)
+            data[:,lo:hi] -= data[:,lo:hi].mean(axis=0)
                     
     def trim(self, bins=0):
         """Trim the end of the data by 'bins' spectra.
@@ -313,7 +889,7 @@ class Spectra(object):
             self.numspectra = self.numspectra-bins
             self.starttime = self.starttime+bins*self.dt
 
-    def downsample(self, factor=1, trim=True):
+    def downsample(self, factor=1, trim=True, remainder=None):
         """Downsample (in-place) the spectra by co-adding
             'factor' adjacent bins.
 
@@ -321,18 +897,58 @@ class Spectra(object):
                 factor: Reduce the number of spectra by this
                     factor. Must be a factor of the number of
                     spectra if 'trim' is False.
-                trim: Trim off excess bins.
+                trim: Trim off excess bins. Ignored if 'remainder'
+                    is provided. (Default: True)
+                remainder: What to do with the excess bins at the
+                    end if the number of spectra is not a multiple
+                    of 'factor'. Either 'trim' (drop them), 'pad'
+                    (co-add them into one more spectrum, scaled up
+                    as if it had 'factor' bins), or 'error' (raise
+                    a ValueError). (Default: 'trim' if 'trim' is
+                    True, 'error' otherwise)
 
             Ouputs:
                 None
 
             *** Downsampling is done in place ***
         """
-        assert trim or not (self.numspectra % factor)
-        new_num_spectra = self.numspectra/factor
-        num_to_trim = self.numspectra%factor
-        self.trim(num_to_trim)
-        self.data = np.array(np.column_stack([np.sum(subint, axis=1) for \
-                        subint in np.hsplit(self.data,new_num_spectra)]))
+        if remainder is None:
+            remainder = trim and 'trim' or 'error'
+        if remainder not in ('trim', 'pad', 'error'):
+            raise ValueError("Unrecognized remainder policy (%s)!" % \
+                             remainder)
+        factor = int(factor)
+        num_full = self.numspectra//factor
+        num_excess = self.numspectra%factor
+        if num_excess and remainder == 'error':
+            raise ValueError("Downsampling factor (%d) is not a factor of " \
+                             "the number of spectra (%d)!" % \
+                             (factor, self.numspectra))
+        new_num_spectra = num_full
+        if num_excess and remainder == 'pad':
+            new_num_spectra += 1
+
+        data = self.data
+        # Splitting the time axis of the full subintegrations does
+        # not copy the data
+        full = data[:,:num_full*factor].reshape(self.numchans, num_full, factor)
+        sumdtype = get_sum_dtype(data.dtype)
+        if isinstance(data, np.ma.MaskedArray):
+            downsampled = full.sum(axis=2, dtype=sumdtype)
+            if new_num_spectra > num_full:
+                excess = data[:,num_full*factor:].sum(axis=1, \
+                                dtype=sumdtype) * (float(factor)/num_excess)
+                downsampled = np.ma.column_stack([downsampled, \
+                                excess.astype(sumdtype)])
+        else:
+            downsampled = np.empty((self.numchans, new_num_spectra), \
+                                   dtype=sumdtype)
+            np.sum(full, axis=2, out=downsampled[:,:num_full])
+            if new_num_spectra > num_full:
+                excess = data[:,num_full*factor:].sum(axis=1, \
+                                                      dtype=sumdtype)
+                downsampled[:,num_full] = excess*(float(factor)/num_excess)
+        self.data = downsampled
+        self.dtype = downsampled.dtype
         self.numspectra = new_num_spectra
         self.dt = self.dt*factor
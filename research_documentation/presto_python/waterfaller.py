@@ -53,12 +53,28 @@ def get_mask(rfimask, startsamp, N):
         mask[blocknums==blocknum] = blockmask
     return mask.T
         
+def get_masked_chans(data, rfimask, startsamp):
+    """Return an array of boolean values, one per channel of
+        the Spectra object 'data', that are True for channels
+        masked in every interval of an rfifind mask overlapping
+        the data, which start at sample 'startsamp'. Channels
+        are in the order of 'data.freqs', as when masking with
+        Spectra.masked.
+    """
+    if data.numspectra == 0:
+        return np.zeros(data.numchans, dtype='bool')
+    firstint = startsamp//rfimask.ptsperint
+    lastint = (startsamp+data.numspectra-1)//rfimask.ptsperint
+    counts = np.zeros(data.numchans, dtype='int')
+    for lo, hi, chans in data._get_rfifind_blocks(rfimask, startsamp):
+        counts[chans] += 1
+    return counts == (lastint-firstint+1)
+        
 def maskfile(maskfn, data, start_bin, nbinsextra):
     rfimask = rfifind.rfifind(maskfn) 
-    mask = get_mask(rfimask, start_bin, nbinsextra)[::-1]
-    masked_chans = mask.all(axis=1)
+    masked_chans = get_masked_chans(data, rfimask, start_bin)
     # Mask data
-    data = data.masked(mask, maskval='median-mid80')
+    data = data.masked(rfimask, maskval='median-mid80', startsamp=start_bin)
 
     #datacopy = copy.deepcopy(data)
     return data, masked_chans
@@ -164,7 +180,7 @@ def waterfall(rawdatafile, start, duration, dm=None, nbins=None, nsub=None,\
 
     # Zerodm filtering
     if (zerodm == True):
-        data.data -=  data.data.mean(axis=0)
+        data.zerodm()
 
     
     # Subband data
@@ -179,7 +195,7 @@ def waterfall(rawdatafile, start, duration, dm=None, nbins=None, nsub=None,\
     data.downsample(downsamp)
 
     # scale data
-    data = data.scaled(scaleindep)
+    data = data.scaled(scaleindep, inplace=True)
     
     # Smooth
     if width_bins > 1:
@@ -0,0 +1,121 @@
+"""
+Fixtures shared by the tests of the presto_python modules.
+
+The presto_python modules import each other by their module names
+(e.g. 'import spectra'), so their directory is put on sys.path.
+"""
+
+import os.path
+import sys
+
+import numpy as np
+import pytest
+
+PRESTO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+                          os.pardir, 'presto_python')
+if PRESTO_DIR not in sys.path:
+    sys.path.insert(0, PRESTO_DIR)
+
+
+def write_psrfits(fn, nsubint=6, nsblk=64, nchan=32, nbits=8, seed=0, \
+                  nsuboffs=0):
+    """Write a small PSRFITS search mode file with random samples,
+        scales, offsets and weights.
+
+        Inputs:
+            fn: Name of the file to write.
+            nsubint: Number of subints. (Default: 6)
+            nsblk: Number of spectra per subint. (Default: 64)
+            nchan: Number of channels. (Default: 32)
+            nbits: Number of bits per sample. (Default: 8)
+            seed: Seed of the random number generator. (Default: 0)
+            nsuboffs: Number of subints before the first one in the
+                file (e.g. when an observation is split into several
+                files). (Default: 0)
+
+        Output:
+            None
+    """
+    import astropy.io.fits as pyfits
+    rng = np.random.RandomState(seed)
+    primary = pyfits.PrimaryHDU()
+    for key, value in [('FITSTYPE', 'PSRFITS'), ('OBS_MODE', 'SEARCH'), \
+                       ('TELESCOP', 'GBT'), ('OBSERVER', 'test'), \
+                       ('SRC_NAME', 'test'), ('FRONTEND', 'test'), \
+                       ('BACKEND', 'test'), ('PROJID', 'test'), \
+                       ('DATE-OBS', '2018-12-11T10:00:00.000'), \
+                       ('FD_POLN', 'LIN'), ('RA', '12:00:00.0'), \
+                       ('DEC', '+10:00:00.0'), ('OBSFREQ', 1400.0), \
+                       ('OBSNCHAN', nchan), ('OBSBW', -float(nchan)), \
+                       ('BMIN', 0.1), ('STT_IMJD', 58463), \
+                       ('STT_SMJD', 36000), ('STT_OFFS', 0.25), \
+                       ('TRK_MODE', 'TRACK'), ('CHAN_DM', 0.0)]:
+        primary.header[key] = value
+    tbin = 64e-6
+    freqs = 1400.0 + nchan/2.0 - np.arange(nchan)
+    nbytes = nsblk*nchan*nbits//8
+    raw = rng.randint(0, 256, size=(nsubint, nsblk, nbytes//nsblk))
+    raw = raw.astype('uint8')
+    weights = np.ones((nsubint, nchan), dtype='float32')
+    weights[:,3] = 0
+    scales = (1 + rng.rand(nsubint, nchan)).astype('float32')
+    offsets = rng.rand(nsubint, nchan).astype('float32')
+    columns = [pyfits.Column(name='TSUBINT', format='1D', \
+                             array=np.ones(nsubint)*nsblk*tbin), \
+               pyfits.Column(name='OFFS_SUB', format='1D', \
+                             array=(np.arange(nsubint)+nsuboffs+0.5) * \
+                                   nsblk*tbin), \
+               pyfits.Column(name='TEL_AZ', format='1D', \
+                             array=np.ones(nsubint)*12.5), \
+               pyfits.Column(name='DAT_FREQ', format='%dD' % nchan, \
+                             array=np.tile(freqs, (nsubint, 1))), \
+               pyfits.Column(name='DAT_WTS', format='%dE' % nchan, \
+                             array=weights), \
+               pyfits.Column(name='DAT_OFFS', format='%dE' % nchan, \
+                             array=offsets), \
+               pyfits.Column(name='DAT_SCL', format='%dE' % nchan, \
+                             array=scales), \
+               pyfits.Column(name='DATA', format='%dB' % nbytes, \
+                             dim='(%d,%d)' % (nbytes//nsblk, nsblk), \
+                             array=raw)]
+    subint = pyfits.BinTableHDU.from_columns(columns, name='SUBINT')
+    for key, value in [('TBIN', tbin), ('NCHAN', nchan), ('NPOL', 1), \
+                       ('POL_TYPE', 'AA+BB'), ('NCHNOFFS', 0), \
+                       ('NSBLK', nsblk), ('NBITS', nbits), \
+                       ('NSUBOFFS', nsuboffs)]:
+        subint.header[key] = value
+    pyfits.HDUList([primary, subint]).writeto(fn)
+
+
+def write_filterbank(fn, nspec=1000, nchan=64, nbits=8, seed=0, \
+                     tstart=58463.0):
+    """Write a small SIGPROC filterbank file with random samples.
+
+        Inputs:
+            fn: Name of the file to write.
+            nspec: Number of spectra. (Default: 1000)
+            nchan: Number of channels. (Default: 64)
+            nbits: Number of bits per sample. (Default: 8)
+            seed: Seed of the random number generator. (Default: 0)
+            tstart: MJD of the first spectrum. (Default: 58463.0)
+
+        Output:
+            data: The (nspec, nchan) array of samples written.
+    """
+    import filterbank
+    rng = np.random.RandomState(seed)
+    header = dict(telescope_id=0, machine_id=0, data_type=1, \
+                  source_name='test', fch1=1500.0, foff=-1.0, \
+                  nchans=nchan, tsamp=0.001, tstart=tstart, nifs=1)
+    data = rng.randint(0, 2**nbits, size=(nspec, nchan)).astype('uint8')
+    filterbank.create_filterbank_file(fn, header, spectra=data, \
+                                      nbits=nbits).close()
+    return data
+
+
+@pytest.fixture(params=[2, 4, 8])
+def psrfits_fn(request, tmpdir):
+    """Name of a PSRFITS file with 2-, 4- or 8-bit samples."""
+    fn = str(tmpdir.join('test_%dbit.fits' % request.param))
+    write_psrfits(fn, nbits=request.param)
+    return fn
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize('bitorder', ['big', 'little'])
+@pytest.mark.parametrize('nbits', [1, 2, 4])
+def test_pack_unpack_round_trip(nbits, bitorder):
+    import bitpacking
+    rng = np.random.RandomState(nbits)
+    samples = rng.randint(0, 2**nbits, size=(5, 64)).astype('uint8')
+    packed = bitpacking.pack(samples, nbits, bitorder)
+    assert packed.shape == (5, 64*nbits//8)
+    unpacked = bitpacking.unpack(packed, nbits, bitorder)
+    assert unpacked.dtype == np.uint8
+    assert np.array_equal(unpacked, samples)
+    # Every byte value survives unpacking and packing again
+    allbytes = np.arange(256, dtype='uint8')
+    assert np.array_equal(bitpacking.pack(bitpacking.unpack(allbytes, nbits, \
+                                                            bitorder), \
+                                          nbits, bitorder), allbytes)
+
+
+@pytest.mark.parametrize('nbits', [1, 2, 4])
+def test_unpack_matches_unpackbits(nbits):
+    import bitpacking
+    data = np.arange(256, dtype='uint8')
+    bits = np.unpackbits(data).reshape(-1, nbits)
+    expected = np.dot(bits, 2**np.arange(nbits-1, -1, -1))
+    assert np.array_equal(bitpacking.unpack(data, nbits), expected)
+
+
+def test_pack_bad_length():
+    import bitpacking
+    with pytest.raises(ValueError):
+        bitpacking.pack(np.zeros(3, dtype='uint8'), 4)
@@ -0,0 +1,69 @@
+import copy
+
+import numpy as np
+import pytest
+
+from .conftest import write_filterbank, write_psrfits
+
+
+def open_reader(fn):
+    if fn.endswith('.fil'):
+        import filterbank
+        return filterbank.FilterbankFile(fn)
+    else:
+        import psrfits
+        return psrfits.PsrfitsFile(fn)
+
+
+@pytest.fixture(params=['filterbank', 'psrfits'])
+def reader(request, tmpdir):
+    fn = str(tmpdir.join('test'))
+    if request.param == 'filterbank':
+        fn += '.fil'
+        write_filterbank(fn)
+    else:
+        fn += '.fits'
+        write_psrfits(fn, nbits=4)
+    reader = open_reader(fn)
+    yield reader
+    reader.close()
+
+
+@pytest.mark.parametrize('prefetch', [0, 2])
+def test_iter_blocks_matches_get_spectra(reader, prefetch):
+    import blockio
+    nspec = int(reader.nspec)
+    whole = reader.get_spectra(0, nspec)
+    blocks = list(blockio.iter_blocks(reader, 100, overlap=7, \
+                                      prefetch=prefetch, start=5))
+    assert len(blocks) == len(range(5, nspec, 100))
+    for ii, block in enumerate(blocks):
+        start = 5+100*ii
+        stop = min(nspec, start+107)
+        assert block.numspectra == stop-start
+        assert np.isclose(block.starttime, whole.starttime+start*reader.tsamp)
+        assert np.array_equal(block.freqs, whole.freqs)
+        assert np.array_equal(block.data, whole.data[:,start:stop])
+
+
+def test_transform_blocks_matches_get_spectra(reader):
+    import blockio
+    dm, factor = 20.0, 4
+
+    def transform(spec):
+        spec = copy.deepcopy(spec)
+        spec.dedisperse(dm, padval=0)
+        spec.downsample(factor)
+        return spec
+
+    nspec = int(reader.nspec)
+    nspec -= nspec % factor
+    expected = transform(reader.get_spectra(0, nspec))
+    result = blockio.transform_blocks(reader, transform, 64, maxdm=dm, \
+                                      nspec=nspec)
+    overlap = blockio.get_dispersion_overlap(reader.freqs, reader.tsamp, dm)
+    # Samples shifted in from beyond the end of the data are only
+    # padding when all of the data are read at once
+    keep = (nspec-overlap)//factor
+    assert result.numspectra == expected.numspectra
+    assert np.allclose(result.data[:,:keep], expected.data[:,:keep])
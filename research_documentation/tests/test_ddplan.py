@@ -0,0 +1,66 @@
+import copy
+
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize('nchan, dt, lodm, hidm, numsub', \
+                         [(32, 1e-3, 0, 200, 8), (32, 1e-3, 0, 200, 32), \
+                          (1024, 64e-6, 0, 1000, 32), \
+                          (256, 1e-4, 5, 60, 16)])
+def test_plan_covers_dm_range(nchan, dt, lodm, hidm, numsub):
+    import ddplan
+    freqs = np.linspace(1500, 1200, nchan)
+    passes = ddplan.plan(freqs, dt, lodm, hidm, numsub)
+    dms = np.concatenate([ddpass.get_dms() for ddpass in passes])
+    assert dms[0] == lodm
+    assert np.all(np.diff(dms) > 0)
+    assert dms[-1] + passes[-1].dmstep >= hidm - 1e-9
+    steps = [ddpass.dmstep for ddpass in passes]
+    downsamps = [ddpass.downsamp for ddpass in passes]
+    assert np.all(np.diff(steps) >= 0)
+    assert np.all(np.diff(downsamps) >= 0)
+    for ddpass in passes:
+        assert ddpass.numsub == numsub
+        assert ddpass.dmstep in ddplan.ALLOWED_DMSTEPS
+        assert ddpass.lodm <= ddpass.subdm <= ddpass.get_dms()[-1]
+    # Within a stage, passes have about the same number of DMs
+    for downsamp in set(downsamps):
+        numdms = [ddpass.numdms for ddpass in passes \
+                    if ddpass.downsamp == downsamp]
+        if len(numdms) > 1:
+            assert min(numdms) >= max(numdms)//2
+
+
+def test_no_tiny_passes():
+    import ddplan
+    passes = ddplan.plan(np.linspace(1500, 1200, 32), 1e-3, 0, 200, 8)
+    assert min(ddpass.numdms for ddpass in passes) > 2
+
+
+def test_dedisperse_plan():
+    import ddplan
+    import spectra
+    rng = np.random.RandomState(0)
+    freqs = np.linspace(1500, 1200, 32)
+    spec = spectra.Spectra(freqs, 1e-3, \
+                           rng.rand(32, 2048).astype('float32'))
+    passes = ddplan.plan(freqs, 1e-3, 0, 100, 8)
+    results = ddplan.dedisperse_plan(spec, passes)
+    assert len(results) == len(passes)
+    for ddpass, (dms, trials) in zip(passes, results):
+        assert np.array_equal(dms, ddpass.get_dms())
+        # Reference: subband at the pass's subband DM, then
+        # dedisperse the subbands at each DM
+        sub = copy.deepcopy(spec)
+        sub.subband(ddpass.numsub, subdm=ddpass.subdm)
+        if ddpass.downsamp > 1:
+            sub.downsample(ddpass.downsamp)
+        assert trials.shape == (len(dms), sub.numspectra)
+        for dm, series in zip(dms, trials):
+            dedisp = copy.deepcopy(sub)
+            dedisp.dedisperse(dm)
+            assert np.allclose(series, dedisp.data.sum(axis=0), rtol=1e-5)
+    threaded = ddplan.dedisperse_plan(spec, passes, nthreads=2)
+    for (_, trials), (_, ttrials) in zip(results, threaded):
+        assert np.array_equal(trials, ttrials)
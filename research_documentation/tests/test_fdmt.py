@@ -0,0 +1,65 @@
+import numpy as np
+
+
+def make_spectra(data, freqs):
+    import spectra
+    return spectra.Spectra(freqs, 1e-3, data)
+
+
+def dm_for_delay(freqs, dt, delay):
+    """Return the DM whose delay across 'freqs' is 'delay' samples."""
+    import psr_utils
+    span = psr_utils.delay_from_DM(1.0, np.min(freqs)) - \
+            psr_utils.delay_from_DM(1.0, np.max(freqs))
+    return delay*dt/span
+
+
+def test_fdmt_matches_dedisperse_trials_for_steady_data():
+    import fdmt
+    nchan, nsamp, maxdelay = 64, 500, 40
+    freqs = np.linspace(1500, 1200, nchan)
+    rng = np.random.RandomState(0)
+    levels = rng.rand(nchan, 1).astype('float32')
+    data = np.repeat(levels, nsamp, axis=1)
+    plane = fdmt.fdmt(data, freqs, maxdelay)
+    assert plane.shape == (maxdelay+1, nsamp)
+    dms = [dm_for_delay(freqs, 1e-3, delay) for delay in range(maxdelay+1)]
+    trials = make_spectra(data, freqs).dedisperse_trials(dms)
+    # Away from the end, where samples are shifted in from beyond the
+    # data, both are the sum of the channels
+    assert np.allclose(plane[:,:nsamp-maxdelay], trials[:,:nsamp-maxdelay])
+
+
+def test_fdmt_finds_dispersed_pulse():
+    import fdmt
+    import psr_utils
+    nchan, nsamp, delay, width = 64, 400, 30, 4
+    freqs = np.linspace(1500, 1200, nchan)
+    dm = dm_for_delay(freqs, 1e-3, delay)
+    delays = psr_utils.delay_from_DM(dm, freqs) - \
+                psr_utils.delay_from_DM(dm, freqs.max())
+    data = np.zeros((nchan, nsamp), dtype='float32')
+    for ii, bindelay in enumerate(np.round(delays/1e-3).astype('int')):
+        data[ii,100+bindelay:100+bindelay+width] = 1
+    plane = fdmt.fdmt(data, freqs, 2*delay)
+    trials = make_spectra(data, freqs).dedisperse_trials([dm])
+    assert trials[0].max() == nchan
+    # Delays can be off by a sample in some channels, which a pulse a
+    # few samples wide absorbs
+    assert 100 <= np.argmax(plane[delay]) < 100+width
+    assert plane[delay].max() == nchan
+    assert plane[2*delay].max() < 0.5*nchan
+
+
+def test_dedisperse_fdmt():
+    import fdmt
+    nchan, nsamp = 32, 300
+    freqs = np.linspace(1500, 1200, nchan)
+    rng = np.random.RandomState(1)
+    data = rng.rand(nchan, nsamp).astype('float32')
+    spec = make_spectra(data, freqs)
+    dms, trials = spec.dedisperse_fdmt(dm_for_delay(freqs, 1e-3, 20))
+    assert np.allclose(trials, fdmt.fdmt(data, freqs, 20))
+    assert len(dms) == 21
+    assert np.allclose(dms, [dm_for_delay(freqs, 1e-3, delay) \
+                             for delay in range(21)])
@@ -0,0 +1,162 @@
+import numpy as np
+import pytest
+
+from .conftest import write_filterbank
+
+
+@pytest.fixture
+def fil_data(tmpdir):
+    fn = str(tmpdir.join('test.fil'))
+    return fn, write_filterbank(fn)
+
+
+def test_mmap_matches_read(fil_data):
+    import filterbank
+    fn, data = fil_data
+    fil = filterbank.FilterbankFile(fn)
+    mapped = filterbank.FilterbankFile(fn, mmap=True)
+    try:
+        assert isinstance(mapped.data, np.memmap)
+        assert mapped.data.shape == data.shape
+        assert np.array_equal(mapped.data, data)
+        spec = mapped.get_spectra(10, 100, dtype=None)
+        assert spec.data.dtype == np.uint8
+        assert np.array_equal(spec.data, data[10:110].T)
+        assert np.array_equal(spec.data, fil.get_spectra(10, 100).data)
+        assert np.array_equal(spec.freqs, fil.frequencies)
+    finally:
+        fil.close()
+        mapped.close()
+
+
+@pytest.mark.parametrize('mmap', [False, True])
+@pytest.mark.parametrize('nbits', [1, 2, 4])
+def test_sub_byte_samples(tmpdir, nbits, mmap):
+    import filterbank
+    fn = str(tmpdir.join('test_%dbit.fil' % nbits))
+    data = write_filterbank(fn, nspec=200, nbits=nbits)
+    fil = filterbank.FilterbankFile(fn, mmap=mmap)
+    try:
+        assert fil.nbits == nbits
+        assert fil.nspec == 200
+        spec = fil.get_spectra(3, 150, dtype=None)
+        assert np.array_equal(spec.data, data[3:153].T)
+    finally:
+        fil.close()
+
+
+@pytest.mark.parametrize('mmap', [False, True])
+@pytest.mark.parametrize('chan_lo, chan_hi, tdecim', [(None, None, 1), \
+                                                      (4, 12, 1), \
+                                                      (0, 64, 3), \
+                                                      (10, 11, 7)])
+def test_selective_reads(fil_data, mmap, chan_lo, chan_hi, tdecim):
+    import filterbank
+    fn, data = fil_data
+    fil = filterbank.FilterbankFile(fn, mmap=mmap)
+    try:
+        spec = fil.get_spectra(10, 100, chan_lo=chan_lo, chan_hi=chan_hi, \
+                               tdecim=tdecim)
+        chans = slice(chan_lo, chan_hi)
+        nout = 100//tdecim
+        expected = data[10:10+nout*tdecim,chans].T.astype('float32')
+        expected = expected.reshape(len(expected), nout, tdecim).sum(axis=2)
+        assert spec.data.dtype == np.float32
+        assert np.array_equal(spec.data, expected)
+        assert np.array_equal(spec.freqs, fil.frequencies[chans])
+        assert np.isclose(spec.dt, fil.tsamp*tdecim)
+    finally:
+        fil.close()
+
+
+def test_bad_tdecim(fil_data):
+    import filterbank
+    fil = filterbank.FilterbankFile(fil_data[0])
+    try:
+        with pytest.raises(ValueError):
+            fil.get_spectra(0, 10, tdecim=0)
+    finally:
+        fil.close()
+
+
+@pytest.fixture
+def fil_series(tmpdir):
+    """Names of three consecutive filterbank files and their samples."""
+    import psr_constants
+    fns, datas = [], []
+    tstart = 58463.0
+    for ii, nspec in enumerate([300, 250, 100]):
+        fns.append(str(tmpdir.join('part%d.fil' % ii)))
+        datas.append(write_filterbank(fns[-1], nspec=nspec, seed=ii, \
+                                      tstart=tstart))
+        tstart += nspec*0.001/psr_constants.SECPERDAY
+    return fns, np.concatenate(datas)
+
+
+@pytest.mark.parametrize('mmap', [False, True])
+def test_series_spans_files(fil_series, mmap):
+    import filterbank
+    fns, data = fil_series
+    series = filterbank.FilterbankSeries(fns, mmap=mmap)
+    try:
+        assert series.nspec == len(data)
+        for start, nspec in [(0, 650), (280, 300), (549, 2), (600, 100)]:
+            spec = series.get_spectra(start, nspec, dtype=None)
+            assert np.array_equal(spec.data, data[start:start+nspec].T)
+            assert np.isclose(spec.starttime, start*0.001)
+        blocks = list(series.iter_blocks(128, overlap=5))
+        assert np.array_equal(blocks[2].data, data[256:389].T)
+    finally:
+        series.close()
+
+
+def test_series_rejects_gaps(fil_series):
+    import filterbank
+    fns, data = fil_series
+    write_filterbank(fns[1], nspec=250, tstart=58464.0)
+    with pytest.raises(ValueError):
+        filterbank.FilterbankSeries(fns)
+
+
+def test_writer_appends_spectra(tmpdir):
+    import filterbank
+    fn = str(tmpdir.join('written.fil'))
+    header = dict(telescope_id=0, machine_id=0, data_type=1, \
+                  source_name='test', fch1=1500.0, foff=-1.0, nchans=16, \
+                  tsamp=0.001, tstart=58463.0, nifs=1, nsamples=0)
+    fil = filterbank.create_filterbank_file(fn, header, nbits=8)
+    rng = np.random.RandomState(0)
+    data = rng.uniform(-10, 300, size=(1000, 16))
+    # A small buffer makes the writer thread swap buffers many times
+    with filterbank.FilterbankWriter(fil, buffer_size=16*64) as writer:
+        for start in range(0, 1000, 70):
+            writer.append_spectra(data[start:start+70])
+    assert fil.nspec == 1000
+    fil.close()
+    fil = filterbank.FilterbankFile(fn)
+    try:
+        assert fil.nspec == 1000
+        assert fil.header['nsamples'] == 1000
+        expected = np.clip(data, 0, 255).astype('uint8')
+        assert np.array_equal(fil.get_spectra(0, 1000, dtype=None).data, \
+                              expected.T)
+    finally:
+        fil.close()
+
+
+def test_writer_does_not_hide_errors(tmpdir):
+    import filterbank
+    fn = str(tmpdir.join('written.fil'))
+    header = dict(telescope_id=0, machine_id=0, data_type=1, \
+                  source_name='test', fch1=1500.0, foff=-1.0, nchans=16, \
+                  tsamp=0.001, tstart=58463.0, nifs=1)
+    fil = filterbank.create_filterbank_file(fn, header, nbits=8)
+    with pytest.raises(KeyError):
+        with filterbank.FilterbankWriter(fil) as writer:
+            writer._error = IOError("Writer thread failed")
+            raise KeyError("Injection failed")
+    writer = filterbank.FilterbankWriter(fil)
+    writer._error = IOError("Writer thread failed")
+    with pytest.raises(IOError):
+        writer.close()
+    fil.close()
@@ -0,0 +1,70 @@
+import copy
+
+import numpy as np
+import pytest
+
+from .test_spectra import make_spectra, FakeRfimask
+
+
+def run_eager(spec, ops):
+    """Apply operations to a copy of 'spec' one after the other."""
+    spec = copy.deepcopy(spec)
+    for name, kwargs in ops:
+        result = getattr(spec, name)(**kwargs)
+        if result is not None:
+            spec = result
+    return spec
+
+
+def run_pipeline(spec, ops, **kwargs):
+    import pipeline
+    pipe = pipeline.SpectraPipeline(spec)
+    for name, opkwargs in ops:
+        getattr(pipe, name)(**opkwargs)
+    return pipe.execute(**kwargs)
+
+
+@pytest.mark.parametrize('dtype', ['float32', None])
+@pytest.mark.parametrize('block_size', [1, 1000, 2**22])
+@pytest.mark.parametrize('ops', [
+    [('dedisperse', dict(dm=100))],
+    [('subband', dict(nsub=4)), ('downsample', dict(factor=3))],
+    [('masked', dict(mask='rfifind', startsamp=10)), \
+     ('subband', dict(nsub=4, subdm=80, padval='median')), \
+     ('dedisperse', dict(dm=100, padval='mean')), \
+     ('downsample', dict(factor=2)), ('scaled', dict(indep=False)), \
+     ('smooth', dict(width=3))],
+    [('masked', dict(mask='array', maskval='mean')), \
+     ('dedisperse', dict(dm=50, padval='rotate')), \
+     ('scaled', dict(indep=True))],
+])
+def test_pipeline_matches_eager(ops, block_size, dtype):
+    spec = make_spectra(nspec=301, dtype=dtype)
+    rng = np.random.RandomState(3)
+    masks = {'rfifind': FakeRfimask(16, 50, [np.array(chans) for chans in \
+                                    [[0], [3, 4], [], [15], [1, 2], [], [7]]]), \
+             'array': rng.rand(16, 301) < 0.1}
+    ops = [(name, dict(kwargs, mask=masks[kwargs['mask']])) \
+                if name == 'masked' else (name, kwargs) \
+           for name, kwargs in ops]
+    data = spec.data.copy()
+    expected = run_eager(spec, ops)
+    result = run_pipeline(spec, ops, block_size=block_size)
+    assert np.array_equal(spec.data, data)
+    assert result.data.shape == expected.data.shape
+    assert np.allclose(result.data, expected.data, rtol=1e-4, atol=1e-4)
+    assert np.allclose(result.freqs, expected.freqs)
+    assert np.isclose(result.dt, expected.dt)
+    assert result.dm == expected.dm
+
+
+def test_operation_order():
+    import pipeline
+    pipe = pipeline.SpectraPipeline(make_spectra())
+    pipe.subband(4)
+    with pytest.raises(ValueError):
+        pipe.subband(4)
+    with pytest.raises(ValueError):
+        pipe.masked(np.zeros((16, 200), dtype='bool'))
+    with pytest.raises(ValueError):
+        pipeline.SpectraPipeline(make_spectra()).subband(5)
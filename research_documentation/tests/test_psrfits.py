@@ -0,0 +1,127 @@
+import astropy.io.fits as pyfits
+import numpy as np
+import pytest
+
+from .conftest import write_psrfits
+
+
+def decode_with_pyfits(fn):
+    """Return the scaled, offset and weighted samples of a PSRFITS
+        file, as a (nchan, nspec) array, decoded with pyfits.
+    """
+    with pyfits.open(fn) as hdus:
+        subints = hdus['SUBINT'].data
+        nbits = hdus['SUBINT'].header['NBITS']
+        nchan = hdus['SUBINT'].header['NCHAN']
+        data = []
+        for row in subints:
+            bits = np.unpackbits(np.asarray(row['DATA'], dtype='uint8'))
+            samples = np.dot(bits.reshape(-1, nbits), \
+                             2**np.arange(nbits-1, -1, -1))
+            samples = samples.reshape(-1, nchan)
+            data.append((samples*row['DAT_SCL'] + row['DAT_OFFS']) * \
+                        row['DAT_WTS'])
+    return np.concatenate(data).T
+
+
+def test_get_spectra(psrfits_fn):
+    import psrfits
+    expected = decode_with_pyfits(psrfits_fn)
+    fits = psrfits.PsrfitsFile(psrfits_fn)
+    try:
+        spec = fits.get_spectra(10, 200)
+        assert spec.data.dtype == np.float32
+        assert np.allclose(spec.data, expected[:,10:210], rtol=1e-6)
+        assert np.array_equal(fits.get_weights(1), \
+                              fits.fits['SUBINT'].data[1]['DAT_WTS'])
+    finally:
+        fits.close()
+
+
+def test_series_pads_gaps(tmpdir):
+    import psrfits
+    # Two subints are missing between the second and third files
+    fns = []
+    for ii, (nsubint, nsuboffs) in enumerate([(5, 0), (4, 5), (3, 11)]):
+        fns.append(str(tmpdir.join('series%d.fits' % ii)))
+        write_psrfits(fns[-1], nsubint=nsubint, seed=ii, nsuboffs=nsuboffs)
+    parts = []
+    for fn in fns:
+        fits = psrfits.PsrfitsFile(fn)
+        try:
+            parts.append(fits.get_spectra(0, int(fits.nspec)).data)
+        finally:
+            fits.close()
+    # Gaps are filled with the mean spectrum of the last subint before them
+    padvals = parts[1][:,-64:].mean(axis=1)
+    expected = np.concatenate([parts[0], parts[1], \
+                               np.repeat(padvals[:,np.newaxis], 128, axis=1), \
+                               parts[2]], axis=1)
+    series = psrfits.PsrfitsSeries(fns, max_open=2)
+    try:
+        assert series.nspec == expected.shape[1] == 64*14
+        full = series.get_spectra(0, series.nspec).data
+        assert np.allclose(full, expected, rtol=1e-5)
+        for startsamp, N in [(10, 300), (300, 200), (500, 300), \
+                             (570, 10), (570, 300)]:
+            spec = series.get_spectra(startsamp, N)
+            assert np.array_equal(spec.data, full[:,startsamp:startsamp+N])
+        # Blocks are read ahead on a background thread
+        blocks = [block.data[:,:100] for block in \
+                  series.iter_blocks(100, overlap=7, prefetch=2)]
+        assert np.array_equal(np.concatenate(blocks, axis=1), full)
+        assert len(series._open) <= 2
+    finally:
+        series.close()
+
+
+@pytest.mark.parametrize('startsamp, N', [(0, 384), (10, 200), (63, 2), \
+                                          (300, 1000)])
+def test_parallel_matches_serial(psrfits_fn, startsamp, N):
+    import psrfits
+    fits = psrfits.PsrfitsFile(psrfits_fn)
+    try:
+        serial = fits.get_spectra(startsamp, N)
+        parallel = fits.get_spectra(startsamp, N, nproc=3)
+        assert parallel.numspectra == serial.numspectra
+        assert parallel.starttime == serial.starttime
+        assert np.array_equal(parallel.freqs, serial.freqs)
+        assert np.array_equal(parallel.data, serial.data)
+    finally:
+        fits.close()
+
+
+def assert_header_equal(scanned, header):
+    assert set(scanned.keys()) >= set(key for key in header.keys() if key)
+    for key, value in header.items():
+        if key and key not in ('COMMENT', 'HISTORY'):
+            assert scanned[key] == value, key
+
+
+def test_scan_psrfits_matches_pyfits(psrfits_fn):
+    import psrfits
+    headers = psrfits.scan_psrfits(psrfits_fn)
+    assert headers.is_psrfits()
+    with pyfits.open(psrfits_fn) as hdus:
+        assert headers.hdu_names == [hdu.name for hdu in hdus]
+        assert_header_equal(headers.primary, hdus[0].header)
+        assert_header_equal(headers.subint, hdus['SUBINT'].header)
+        columns = hdus['SUBINT'].columns
+        assert headers.colnames == columns.names
+        assert headers.colformats == [str(fmt) for fmt in columns.formats]
+        first = hdus['SUBINT'].data[0]
+        for name, value in headers.first_subint.items():
+            assert np.array_equal(value, first[name]), name
+
+
+def test_spectra_info_from_index(psrfits_fn, tmpdir):
+    import psrfits
+    indexfn = str(tmpdir.join('headers.idx'))
+    index = psrfits.scan_headers([psrfits_fn], indexfn)
+    index.save()
+    direct = psrfits.SpectraInfo([psrfits_fn])
+    indexed = psrfits.SpectraInfo([psrfits_fn], index=index)
+    for name in ('N', 'dt', 'num_channels', 'bits_per_sample', 'lo_freq', \
+                 'hi_freq', 'df', 'azimuth', 'source', 'date_obs'):
+        assert np.all(getattr(indexed, name) == getattr(direct, name)), name
+    assert np.array_equal(indexed.start_MJD, direct.start_MJD)
@@ -0,0 +1,62 @@
+import os
+import os.path
+
+import pytest
+
+from .conftest import write_filterbank
+
+
+def read_header_slowly(fn):
+    """Read a header one value at a time with read_hdr_val."""
+    import sigproc
+    header = {}
+    with open(fn, 'rb') as infile:
+        param = None
+        while param != "HEADER_END":
+            param, value = sigproc.read_hdr_val(infile)
+            header[param] = value
+        return header, infile.tell()
+
+
+def test_parse_header_matches_read_hdr_val(tmpdir):
+    import sigproc
+    fn = str(tmpdir.join('test.fil'))
+    write_filterbank(fn, nspec=10)
+    expected = read_header_slowly(fn)
+    assert sigproc.read_header(fn) == expected
+    with open(fn, 'rb') as infile:
+        buf = infile.read()
+    assert sigproc.parse_header(buf) == expected
+    with pytest.raises(EOFError):
+        sigproc.parse_header(buf[:expected[1]-5])
+
+
+def test_scan_headers(tmpdir, monkeypatch):
+    import sigproc
+    cachedir = tmpdir.mkdir('cache')
+    monkeypatch.setenv('XDG_CACHE_HOME', str(cachedir))
+    datadir = tmpdir.mkdir('data')
+    fns = [str(datadir.join('part%d.fil' % ii)) for ii in range(3)]
+    for ii, fn in enumerate(fns):
+        write_filterbank(fn, nspec=100+ii)
+    headers = sigproc.scan_headers(str(datadir))
+    assert sorted(headers.keys()) == fns
+    for ii, fn in enumerate(fns):
+        hdrdict, hdrlen = sigproc.read_header(fn)
+        assert headers[fn] == (hdrdict, hdrlen, 100+ii)
+    # The index is kept in the user's cache, not with the data
+    assert sorted(os.listdir(str(datadir))) == sorted(map(os.path.basename, \
+                                                          fns))
+    assert cachedir.join('presto_python', 'sigproc_headers.idx').check()
+
+    # Unchanged files are not parsed again
+    monkeypatch.setattr(sigproc, 'read_header', None)
+    assert sigproc.scan_headers(str(datadir)) == headers
+
+
+def test_utils_sigproc_shares_parser(monkeypatch):
+    monkeypatch.syspath_prepend(os.path.join(os.path.dirname(__file__), \
+                                             os.pardir))
+    import utils.sigproc
+    import presto_python.sigproc
+    assert utils.sigproc.parse_header is presto_python.sigproc.parse_header
@@ -0,0 +1,219 @@
+import copy
+
+import numpy as np
+import pytest
+
+
+def make_spectra(nchan=16, nspec=200, dtype='float32', seed=0, **kwargs):
+    import spectra
+    rng = np.random.RandomState(seed)
+    data = rng.randint(0, 256, size=(nchan, nspec)).astype('uint8')
+    freqs = np.linspace(1500, 1200, nchan)
+    return spectra.Spectra(freqs, 1e-3, data, dtype=dtype, **kwargs)
+
+
+def test_dtype():
+    spec = make_spectra()
+    assert spec.data.dtype == np.float32
+    native = make_spectra(dtype=None)
+    assert native.data.dtype == np.uint8
+    assert np.array_equal(native.data, spec.data)
+    # Shifting only moves samples, so the native type is kept
+    native.dedisperse(100)
+    spec.dedisperse(100)
+    assert native.data.dtype == np.uint8
+    assert np.array_equal(native.data, spec.data)
+
+
+@pytest.mark.parametrize('operation', [lambda spec: spec.subband(4), \
+                                       lambda spec: spec.downsample(4), \
+                                       lambda spec: spec.smooth(4)])
+def test_sums_of_native_samples_are_floats(operation):
+    spec = make_spectra()
+    native = make_spectra(dtype=None)
+    native.data[:] = 200
+    spec.data[:] = 200
+    operation(spec)
+    operation(native)
+    assert native.data.dtype.kind == 'f'
+    assert native.dtype == native.data.dtype
+    assert np.allclose(native.data, spec.data)
+    assert native.data.max() > 255
+
+
+def shift_reference(data, bins, padval):
+    """Shift each channel with np.roll, then pad, one at a time."""
+    shifted = np.empty_like(data)
+    for ii, (chan, nbins) in enumerate(zip(data, bins)):
+        rolled = np.roll(chan, -nbins)
+        if padval == 'mean':
+            pad = np.mean(rolled)
+        elif padval == 'median':
+            pad = np.median(rolled)
+        else:
+            pad = padval
+        if padval != 'rotate':
+            if nbins > 0:
+                rolled[-nbins:] = pad
+            elif nbins < 0:
+                rolled[:-nbins] = pad
+        shifted[ii] = rolled
+    return shifted
+
+
+@pytest.mark.parametrize('nspec', [100, 3000])
+@pytest.mark.parametrize('padval', [0, 7.5, 'mean', 'median', 'rotate'])
+def test_shift_channels(nspec, padval):
+    import spectra
+    assert 100 < spectra.SHIFT_GATHER_MAX_LEN < 3000
+    spec = make_spectra(nspec=nspec)
+    rng = np.random.RandomState(1)
+    bins = rng.randint(-nspec//2, nspec//2, size=spec.numchans)
+    bins[:3] = [0, nspec-1, -(nspec-1)]
+    expected = shift_reference(spec.data.copy(), bins, padval)
+    spec.shift_channels(bins, padval=padval)
+    assert np.allclose(spec.data, expected)
+
+
+@pytest.mark.parametrize('nspec', [300, 40000])
+def test_dedisperse_trials(nspec):
+    import spectra
+    spec = make_spectra(nspec=nspec, dm=5.0)
+    spec.dt = 1e-4
+    dms = [5.0, 6.5, 40.0, 300.0, 10000.0]
+    expected = []
+    for dm in dms:
+        dedisp = copy.deepcopy(spec)
+        dedisp.dedisperse(dm)
+        expected.append(dedisp.data.sum(axis=0))
+    # Long channels are added one DM at a time
+    assert (nspec > spectra.TRIALS_BLOCK_SIZE//2) == (nspec == 40000)
+    trials = spec.dedisperse_trials(dms)
+    assert trials.shape == (len(dms), nspec)
+    assert np.allclose(trials, expected)
+    assert np.array_equal(spec.dedisperse_trials(dms, nthreads=3), trials)
+    try:
+        spectra.Spectra.set_executor(2)
+        assert np.array_equal(spec.dedisperse_trials(dms), trials)
+    finally:
+        spectra.Spectra.set_executor(1)
+    assert spec.dedisperse_trials([]).shape == (0, nspec)
+
+
+class FakeRfimask(object):
+    """Stand-in for an rfifind.rfifind object with the attributes
+        used for masking.
+    """
+    def __init__(self, nchan, ptsperint, zap_chans_per_int):
+        self.nchan = nchan
+        self.ptsperint = ptsperint
+        self.mask_zap_chans_per_int = zap_chans_per_int
+
+
+@pytest.mark.parametrize('ascending', [False, True])
+@pytest.mark.parametrize('maskval', ['median-mid80', 'mean', 3.0])
+def test_masked_with_rfifind(ascending, maskval):
+    import waterfaller
+    startsamp = 130
+    # The data overlap intervals 2 to 6, the first of which is empty
+    zapped = [[0], [2], [], [2, 5, 15], [2, 7], [9, 2], [0, 1, 2], [3]]
+    rfimask = FakeRfimask(16, 50, [np.array(chans) for chans in zapped])
+    spec = make_spectra()
+    if ascending:
+        spec.freqs = spec.freqs[::-1]
+    # rfifind channels go from low to high frequency
+    boolmask = np.zeros((spec.numchans, spec.numspectra), dtype='bool')
+    for isamp in range(spec.numspectra):
+        chans = zapped[(startsamp+isamp)//rfimask.ptsperint]
+        boolmask[chans,isamp] = True
+    if not ascending:
+        boolmask = boolmask[::-1]
+    expected = copy.deepcopy(spec).masked(boolmask, maskval=maskval)
+    masked = spec.masked(rfimask, maskval=maskval, startsamp=startsamp)
+    assert np.allclose(masked.data, expected.data)
+    assert not waterfaller.get_masked_chans(spec, rfimask, startsamp).any()
+    # Starting at sample 150, only channel 2 is zapped in every interval
+    chans = np.flatnonzero(waterfaller.get_masked_chans(spec, rfimask, 150))
+    assert list(chans) == [2 if ascending else 13]
+
+
+def test_boxcar_filterbank():
+    import spectra
+    rng = np.random.RandomState(2)
+    series = rng.normal(size=(3, 500))
+    series[1,200:210] += 5
+    widths = [1, 4, 10, 30]
+    snrs, positions = spectra.boxcar_filterbank(series, widths)
+    assert snrs.shape == positions.shape == (len(widths), 3)
+    for ii, width in enumerate(widths):
+        for jj, ts in enumerate(series):
+            sums = np.convolve(ts, np.ones(width), mode='valid')
+            snr = (sums-width*np.median(ts))/(ts.std()*np.sqrt(width))
+            assert positions[ii,jj] == np.argmax(sums)
+            assert np.isclose(snrs[ii,jj], snr.max())
+    assert positions[2,1] == 200
+    assert np.argmax(snrs[:,1]) == 2
+    # A single series gives one value per width
+    snr, pos = spectra.boxcar_filterbank(series[1], widths)
+    assert np.allclose(snr, snrs[:,1])
+    assert np.array_equal(pos, positions[:,1])
+    for width in [0, 501]:
+        with pytest.raises(ValueError):
+            spectra.boxcar_filterbank(series, [1, width])
+    spec = make_spectra()
+    snr, pos = spec.boxcar_filterbank(widths)
+    expected = spectra.boxcar_filterbank(spec.data.sum(axis=0), widths)
+    assert np.allclose(snr, expected[0])
+    assert np.array_equal(pos, expected[1])
+
+
+@pytest.mark.parametrize('block_size', [100, 2**20])
+def test_remove_baseline_mean(monkeypatch, block_size):
+    import spectra
+    monkeypatch.setattr(spectra, 'BASELINE_BLOCK_SIZE', block_size)
+    spec = make_spectra(nspec=300)
+    data = spec.data.astype('float64')
+    window = 21
+    spec.remove_baseline(window, method='mean')
+    expected = np.empty_like(data)
+    for isamp in range(spec.numspectra):
+        lo = max(0, isamp-window//2)
+        expected[:,isamp] = data[:,isamp] - data[:,lo:lo+window].mean(axis=1)
+    assert np.allclose(spec.data, expected, atol=1e-3)
+
+
+@pytest.mark.parametrize('block_size', [100, 2**20])
+def test_remove_baseline_median(monkeypatch, block_size):
+    import scipy.ndimage
+    import spectra
+    monkeypatch.setattr(spectra, 'BASELINE_BLOCK_SIZE', block_size)
+    spec = make_spectra(nspec=5000)
+    # A slowly varying baseline under the noise
+    spec.data += 500*np.sin(np.arange(5000)/700.0)
+    exact = spec.data - scipy.ndimage.median_filter(spec.data, \
+                                    size=(1, 801), mode='nearest')
+    spec.remove_baseline(801, method='median')
+    assert abs(np.median(spec.data)) < 5
+    # Away from the ends, the approximate baseline is within a tenth
+    # of the baseline's amplitude of the exact running median
+    error = np.abs(spec.data-exact)[:,800:-800]
+    assert np.median(error) < 15
+    assert error.max() < 50
+    with pytest.raises(ValueError):
+        spec.remove_baseline(0)
+    with pytest.raises(ValueError):
+        spec.remove_baseline(10, method='mode')
+    with pytest.raises(ValueError):
+        make_spectra(dtype=None).remove_baseline(10)
+
+
+def test_zerodm(monkeypatch):
+    import spectra
+    monkeypatch.setattr(spectra, 'BASELINE_BLOCK_SIZE', 100)
+    spec = make_spectra()
+    expected = spec.data - spec.data.mean(axis=0)
+    spec.zerodm()
+    assert np.allclose(spec.data, expected, atol=1e-4)
+    assert np.allclose(spec.data.mean(axis=0), 0, atol=1e-4)
+    with pytest.raises(ValueError):
+        make_spectra(dtype=None).zerodm()
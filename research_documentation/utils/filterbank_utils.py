@@ -13,18 +13,10 @@ def read_header(filename, verbose=False):
             header: A dictionary of header paramters.
             header_size: The size of the header in bytes.
     """
-    header = {}
-    filfile = open(filename, 'rb')
-    filfile.seek(0)
-    paramname = ""
-    while (paramname != 'HEADER_END'):
-        if verbose:
-            print "File location: %d" % filfile.tell()
-        paramname, val = sigproc.read_hdr_val(filfile, stdout=verbose)
-        if verbose:
-            print "Read param %s (value: %s)" % (paramname, val)
-        if paramname not in ["HEADER_START", "HEADER_END"]:
-            header[paramname] = val
-    header_size = filfile.tell()
-    filfile.close()
+    header, header_size = sigproc.read_header(filename)
+    for paramname in ["HEADER_START", "HEADER_END"]:
+        header.pop(paramname, None)
+    if verbose:
+        for paramname in sorted(header.keys()):
+            print "Read param %s (value: %s)" % (paramname, header[paramname])
     return header, header_size